@@ -3,7 +3,9 @@ from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
+from django.utils import timezone
 from . import models
+from .payments import set_payment_statuses
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -57,7 +59,8 @@ class ProductAdmin(admin.ModelAdmin):
 
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
+        updated_count = queryset.update(
+            inventory=0, last_update=timezone.now())
         self.message_user(
             request,
             f'{updated_count} products were successfully updated.',
@@ -86,10 +89,13 @@ class CollectionAdmin(admin.ModelAdmin):
             }))
         return format_html('<a href="{}">{} Products</a>', url, collection.products_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        )
+
+@admin.register(models.TaxRate)
+class TaxRateAdmin(admin.ModelAdmin):
+    autocomplete_fields = ['collection']
+    list_display = ['region', 'collection', 'rate']
+    list_filter = ['region']
+    list_select_related = ['collection']
 
 
 @admin.register(models.Customer)
@@ -125,8 +131,48 @@ class OrderItemInline(admin.TabularInline):
     extra = 0
 
 
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = models.ArchivedOrderItem
+    extra = 0
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    inlines = [ArchivedOrderItemInline]
+    list_display = ['id', 'placed_at', 'customer']
+    list_select_related = ['customer__user']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
+    actions = ['mark_complete', 'mark_failed']
     autocomplete_fields = ['customer']
     inlines = [OrderItemInline]
     list_display = ['id', 'placed_at', 'customer']
+
+    @admin.action(description='Mark payment complete')
+    def mark_complete(self, request, queryset):
+        self.set_payment_status(request, queryset, models.Order.PAYMENT_STATUS_COMPLETE)
+
+    @admin.action(description='Mark payment failed')
+    def mark_failed(self, request, queryset):
+        self.set_payment_status(request, queryset, models.Order.PAYMENT_STATUS_FAILED)
+
+    def set_payment_status(self, request, queryset, status):
+        order_ids = list(queryset.values_list('id', flat=True))
+        changes = set_payment_statuses({order_id: status for order_id in order_ids})
+        updated_count = len(changes.get(status, []))
+        self.message_user(
+            request,
+            f'{updated_count} orders were successfully updated, '
+            f'{len(order_ids) - updated_count} could not make that transition.'
+        )
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+ORDER_FIELDS = ['id', 'placed_at', 'payment_status', 'customer_id', 'last_update']
+ITEM_FIELDS = ['id', 'order_id', 'product_id', 'quantity', 'unit_price']
+
+
+def archive_orders(age=None, batch_size=500):
+    """
+    Move complete orders placed more than `age` seconds ago
+    (ORDER_ARCHIVE_AGE by default), with their items, to the archive
+    tables in batches of `batch_size`, each in its own short transaction,
+    and return how many were moved. Ids are kept, so an order is found
+    under the same id in one table or the other.
+    """
+    if age is None:
+        age = settings.ORDER_ARCHIVE_AGE
+    cutoff = timezone.now() - timedelta(seconds=age)
+    cold = Order.objects.filter(
+        payment_status=Order.PAYMENT_STATUS_COMPLETE, placed_at__lt=cutoff)
+    archived = 0
+    while True:
+        with transaction.atomic():
+            orders = cold \
+                .select_for_update(skip_locked=True) \
+                .order_by('id') \
+                .values(*ORDER_FIELDS)
+            orders = list(orders[:batch_size])
+            if not orders:
+                return archived
+            order_ids = [order['id'] for order in orders]
+            items = OrderItem.objects \
+                .filter(order_id__in=order_ids) \
+                .values(*ITEM_FIELDS)
+            ArchivedOrder.objects.bulk_create(
+                [ArchivedOrder(**order) for order in orders])
+            ArchivedOrderItem.objects.bulk_create(
+                [ArchivedOrderItem(**item) for item in items])
+            OrderItem.objects.filter(order_id__in=order_ids).delete()
+            Order.objects.filter(pk__in=order_ids).delete()
+        archived += len(orders)
+        if len(orders) < batch_size:
+            return archived
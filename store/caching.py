@@ -0,0 +1,175 @@
+import time
+from datetime import datetime, timezone
+from hashlib import md5
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date, parse_etags
+from rest_framework.response import Response
+
+GENERATION_KEY = 'store:generation:{}'
+RESPONSE_KEY = 'store:response:{}'
+BUMPED_KEY = 'store:generation:{}:bumped'
+
+
+def get_generation_key(model):
+    return GENERATION_KEY.format(model._meta.label_lower)
+
+
+def get_generations(models):
+    keys = [get_generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        # Seed evicted counters like get_generation does, so entries cached
+        # under an older generation never become reachable again.
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        generations.update(cache.get_many(missing))
+    return [generations.get(key, 0) for key in keys]
+
+
+def get_generation(model):
+    key = get_generation_key(model)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(model):
+    key = get_generation_key(model)
+    # Seed from the clock so an evicted counter never reuses old values.
+    if not cache.add(key, time.time_ns(), timeout=None):
+        cache.incr(key)
+    cache.set(BUMPED_KEY.format(model._meta.label_lower), time.time(), timeout=None)
+
+
+def get_last_modified(models):
+    """
+    When any of `models` last changed, from the generation bumps, so
+    deletes count too and no query is needed. A model with no recorded
+    bump counts as changed now: after a cache flush clients refetch
+    rather than get a stale 304.
+    """
+    keys = [BUMPED_KEY.format(model._meta.label_lower) for model in models]
+    bumped = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in bumped:
+            cache.add(key, now, timeout=None)
+            bumped[key] = now
+    if not bumped:
+        return None
+    return datetime.fromtimestamp(max(bumped.values()), tz=timezone.utc)
+
+
+def invalidate(*models):
+    """
+    Bump the generation of `models` once the current transaction commits,
+    so no request can cache rows that are about to change.
+    """
+    def bump():
+        for model in models:
+            bump_generation(model)
+    transaction.on_commit(bump)
+
+
+def get_request_signature(request):
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    return f'{request.get_host()}{request.path}?{params}'
+
+
+def get_response_key(request, models):
+    generations = ':'.join(str(g) for g in get_generations(models))
+    raw = f'{get_request_signature(request)}|{generations}'
+    return RESPONSE_KEY.format(md5(raw.encode()).hexdigest())
+
+
+class CachedResponseMixin:
+    """
+    Serves anonymous list and retrieve requests from the cache. Entries are
+    keyed by the query and the generations of `cache_models`, so any write
+    to those models makes them unreachable.
+    """
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+
+        key = get_response_key(request, self.cache_models)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified to list and retrieve responses and answers
+    matching If-None-Match / If-Modified-Since with 304 before anything is
+    serialized. Both come from the generations of `cache_models`; override
+    `get_validators` to derive them otherwise.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.get_conditional_response(
+            queryset, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_queryset().filter(
+            **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        return self.get_conditional_response(
+            queryset, super().retrieve, request, *args, **kwargs)
+
+    def get_validators(self, queryset):
+        """
+        Return a token that changes whenever the response would, and the
+        time of the last modification if it is known.
+        """
+        models = getattr(self, 'cache_models', ())
+        generations = get_generations(models)
+        return ':'.join(str(g) for g in generations), get_last_modified(models)
+
+    def get_conditional_response(self, queryset, handler, request, *args, **kwargs):
+        token, last_modified = self.get_validators(queryset)
+        # The renderer is part of the representation (JSON vs browsable API).
+        raw = f'{get_request_signature(request)}|{request.accepted_renderer.format}|{token}'
+        etag = quote_etag(md5(raw.encode()).hexdigest())
+        if last_modified is not None:
+            last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is not None and self.action == 'retrieve' \
+                and etag not in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')) \
+                and not queryset.exists():
+            # Our exact ETag was issued for this object at the current
+            # generations, so it still exists. `*` or a date alone say
+            # nothing about the id; let the handler answer 404.
+            response = None
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
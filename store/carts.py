@@ -0,0 +1,317 @@
+from datetime import timedelta
+from uuid import UUID, uuid4
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Cart, CartItem, Product
+
+CART_KEY = 'store:cart:{}'
+MATERIALIZED_KEY = 'store:cart:materialized:{}'
+CART_TOKEN_SALT = 'store.carts'
+# Hash field holding the creation time; every other field is a product id.
+CREATED_FIELD = 'created_at'
+
+# Only touch carts that still exist, so a write racing a delete or an
+# expiry can't bring back a cart without its created_at.
+ADD_ITEM_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then return nil end
+local quantity = redis.call('hincrby', KEYS[1], ARGV[1], ARGV[2])
+redis.call('expire', KEYS[1], ARGV[3])
+return quantity
+"""
+SET_QUANTITY_SCRIPT = """
+if redis.call('hexists', KEYS[1], ARGV[1]) == 0 then return nil end
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+redis.call('expire', KEYS[1], ARGV[3])
+return tonumber(ARGV[2])
+"""
+# ARGV: timeout, then (op, product_id, quantity) triples
+APPLY_OPERATIONS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then return 0 end
+for i = 2, #ARGV, 3 do
+  local op, product_id, quantity = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+  if op == 'add' then
+    redis.call('hincrby', KEYS[1], product_id, quantity)
+  elseif op == 'set' and quantity > 0 then
+    redis.call('hset', KEYS[1], product_id, quantity)
+  else
+    redis.call('hdel', KEYS[1], product_id)
+  end
+end
+redis.call('expire', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def get_cart_store():
+    """
+    The configured cart store, or None when carts live in the database
+    (CART_ENGINE = 'db', the default).
+    """
+    if settings.CART_ENGINE == 'redis':
+        return RedisCartStore(settings.CART_CACHE, settings.CART_TIMEOUT)
+    return None
+
+
+def purge_abandoned_carts(age=None, batch_size=1000):
+    """
+    Delete database carts idle for longer than `age` seconds (CART_TIMEOUT
+    by default) in batches of `batch_size`, each in its own short
+    transaction, and return how many were deleted. Redis carts expire on
+    their own.
+    """
+    if age is None:
+        age = settings.CART_TIMEOUT
+    cutoff = timezone.now() - timedelta(seconds=age)
+    abandoned = Cart.objects.filter(last_activity__lt=cutoff)
+    purged = 0
+    while True:
+        batch = list(abandoned
+                     .order_by('last_activity')
+                     .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return purged
+        # Re-check the cutoff so a cart touched since the SELECT survives
+        with transaction.atomic():
+            _, deleted = abandoned.filter(pk__in=batch).delete()
+        purged += deleted.get(Cart._meta.label, 0)
+        if len(batch) < batch_size:
+            return purged
+
+
+def sign_cart_id(cart_id):
+    return signing.Signer(salt=CART_TOKEN_SALT).sign(UUID(str(cart_id)).hex)
+
+
+def parse_cart_id(value):
+    """
+    Return (cart UUID, token) for a plain cart id, whose token is None, or
+    for a signed cart token. Raise ValueError for anything else.
+    """
+    try:
+        return UUID(str(value)), None
+    except ValueError:
+        pass
+    try:
+        return UUID(signing.Signer(salt=CART_TOKEN_SALT).unsign(str(value))), str(value)
+    except signing.BadSignature:
+        raise ValueError(f'{value!r} is neither a cart id nor a cart token.')
+
+
+def create_lazy_cart():
+    """
+    Issue a signed token for a cart that has no row yet. The row is
+    created by `materialize` when the first item is added.
+    """
+    cart = Cart(id=uuid4(), created_at=timezone.now())
+    cache.set(MATERIALIZED_KEY.format(cart.id), False, settings.CART_TIMEOUT)
+    return get_empty_cart(cart, sign_cart_id(cart.id))
+
+
+def get_empty_cart(cart, token):
+    cart.token = token
+    return attach_items(cart, [])
+
+
+def is_materialized(cart_id):
+    """
+    Whether a token cart has a row: True or False when the cache knows,
+    None when only the database can tell (e.g. after an eviction).
+    """
+    return cache.get(MATERIALIZED_KEY.format(cart_id))
+
+
+def set_materialized(cart_id, materialized):
+    cache.set(MATERIALIZED_KEY.format(cart_id), materialized, settings.CART_TIMEOUT)
+
+
+def materialize(cart_id):
+    if not is_materialized(cart_id):
+        Cart.objects.get_or_create(id=cart_id)
+        set_materialized(cart_id, True)
+
+
+def attach_items(cart, items):
+    """Make `cart.items.all()` return `items` as if they were prefetched."""
+    queryset = CartItem.objects.none()
+    queryset._result_cache = list(items)
+    queryset._prefetch_done = True
+    cart._prefetched_objects_cache = {'items': queryset}
+    return cart
+
+
+class RedisCartStore:
+    """
+    Keeps each cart in a Redis hash of {product_id: quantity} that expires
+    after `timeout` seconds without writes. Carts reach the Cart/CartItem
+    tables only through `flush`, which checkout calls before building the
+    order. Items are addressed by their product id.
+    """
+
+    def __init__(self, alias='default', timeout=None):
+        from django_redis import get_redis_connection
+        self.redis = get_redis_connection(alias)
+        self.timeout = timeout
+        self.add_item_script = self.redis.register_script(ADD_ITEM_SCRIPT)
+        self.set_quantity_script = self.redis.register_script(SET_QUANTITY_SCRIPT)
+        self.apply_operations_script = self.redis.register_script(APPLY_OPERATIONS_SCRIPT)
+
+    def get_key(self, cart_id):
+        try:
+            return CART_KEY.format(UUID(str(cart_id)))
+        except ValueError:
+            return None
+
+    def create(self):
+        cart = Cart(id=uuid4(), created_at=timezone.now())
+        key = self.get_key(cart.id)
+        with self.redis.pipeline() as pipe:
+            pipe.hset(key, CREATED_FIELD, cart.created_at.isoformat())
+            pipe.expire(key, self.timeout)
+            pipe.execute()
+        return attach_items(cart, [])
+
+    def exists(self, cart_id):
+        key = self.get_key(cart_id)
+        return key is not None and bool(self.redis.exists(key))
+
+    def count_items(self, cart_id):
+        key = self.get_key(cart_id)
+        if key is None:
+            return 0
+        return max(self.redis.hlen(key) - 1, 0)
+
+    def get_quantities(self, cart_id):
+        """Return ({product_id: quantity}, created_at), or None if missing."""
+        key = self.get_key(cart_id)
+        fields = self.redis.hgetall(key) if key is not None else {}
+        if not fields:
+            return None
+        created_at = parse_datetime(fields.pop(CREATED_FIELD.encode(), b'').decode())
+        quantities = {int(product_id): int(quantity)
+                      for product_id, quantity in fields.items()}
+        return quantities, created_at
+
+    def get_items(self, cart_id):
+        result = self.get_quantities(cart_id)
+        if result is None:
+            return []
+        return self.build_items(Cart(id=UUID(str(cart_id))), result[0])
+
+    def build_items(self, cart, quantities):
+        # Products removed from the catalog since they were added are dropped.
+        products = Product.objects \
+            .only('id', 'title', 'unit_price') \
+            .in_bulk(list(quantities))
+        return [
+            CartItem(id=product_id, cart=cart, product=products[product_id],
+                     quantity=quantity)
+            for product_id, quantity in sorted(quantities.items())
+            if product_id in products
+        ]
+
+    def get(self, cart_id):
+        result = self.get_quantities(cart_id)
+        if result is None:
+            return None
+        quantities, created_at = result
+        cart = Cart(id=UUID(str(cart_id)), created_at=created_at)
+        items = self.build_items(cart, quantities)
+        # Priced on read, so there are no stored totals to go stale
+        cart.items_count = sum(item.quantity for item in items)
+        cart.subtotal = sum(item.quantity * item.product.unit_price for item in items)
+        return attach_items(cart, items)
+
+    def get_item(self, cart_id, item_id):
+        key = self.get_key(cart_id)
+        if key is None or not str(item_id).isdigit():
+            return None
+        quantity = self.redis.hget(key, int(item_id))
+        if quantity is None:
+            return None
+        return self.build_item(cart_id, item_id, int(quantity))
+
+    def build_item(self, cart_id, product_id, quantity):
+        product = Product.objects \
+            .only('id', 'title', 'unit_price') \
+            .filter(pk=product_id) \
+            .first()
+        if product is None:
+            return None
+        return CartItem(id=product.id, cart_id=UUID(str(cart_id)),
+                        product=product, quantity=quantity)
+
+    def add_item(self, cart_id, product_id, quantity):
+        """Add `quantity` of a product; returns None if the cart is gone."""
+        key = self.get_key(cart_id)
+        if key is None:
+            return None
+        quantity = self.add_item_script(
+            keys=[key], args=[product_id, quantity, self.timeout])
+        if quantity is None:
+            return None
+        return self.build_item(cart_id, product_id, quantity)
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        key = self.get_key(cart_id)
+        if key is None:
+            return None
+        quantity = self.set_quantity_script(
+            keys=[key], args=[int(item_id), quantity, self.timeout])
+        if quantity is None:
+            return None
+        return self.build_item(cart_id, item_id, quantity)
+
+    def remove_item(self, cart_id, item_id):
+        key = self.get_key(cart_id)
+        return key is not None and bool(self.redis.hdel(key, int(item_id)))
+
+    def apply_operations(self, cart_id, operations):
+        """
+        Apply bulk cart operations in one script, so they all land or none
+        do; returns False if the cart is gone.
+        """
+        key = self.get_key(cart_id)
+        if key is None:
+            return False
+        args = [self.timeout]
+        for operation in operations:
+            args += [operation['op'], operation['product_id'], operation.get('quantity') or 0]
+        return bool(self.apply_operations_script(keys=[key], args=args))
+
+    def delete(self, cart_id):
+        key = self.get_key(cart_id)
+        return key is not None and bool(self.redis.delete(key))
+
+    def flush(self, cart_id):
+        """
+        Write the cart to the Cart/CartItem tables, replacing whatever an
+        earlier flush left there. The Redis copy stays authoritative.
+        """
+        result = self.get_quantities(cart_id)
+        if result is None:
+            return None
+        quantities, _ = result
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(id=UUID(str(cart_id)))
+            CartItem.objects.filter(cart=cart).delete()
+            product_ids = Product.objects \
+                .filter(pk__in=list(quantities)) \
+                .values_list('id', flat=True)
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product_id=product_id,
+                         quantity=quantities[product_id])
+                for product_id in sorted(product_ids)
+            ])
+            Cart.objects.filter(pk=cart.pk).refresh_totals()
+        return cart
+
+    def flush_all(self, batch_size=1000):
+        count = 0
+        for key in self.redis.scan_iter(match=CART_KEY.format('*'), count=batch_size):
+            if self.flush(key.decode().rsplit(':', 1)[1]) is not None:
+                count += 1
+        return count
@@ -0,0 +1,85 @@
+import csv
+import heapq
+import json
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CSV_HEADER = ['order_id', 'placed_at', 'payment_status', 'customer_id',
+              'product_id', 'quantity', 'unit_price']
+
+
+class Echo:
+    """A file-like object whose write() returns the line instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_orders(querysets, batch_size=1000):
+    """
+    Yield (order, items) for the orders of `querysets`, e.g. the live and
+    the archived ones, merged by id. Order ids are unique across both.
+    """
+    return heapq.merge(*[iter_table_orders(queryset, batch_size) for queryset in querysets],
+                       key=lambda row: row[0]['id'])
+
+
+def iter_table_orders(queryset, batch_size=1000):
+    """
+    Yield (order, items) for the orders of `queryset` by id, as dicts.
+    Seeks by id one batch at a time rather than holding a cursor open, so
+    memory stays flat on backends without server-side cursors too.
+    """
+    item_model = queryset.model._meta.get_field('items').related_model
+    orders = queryset \
+        .order_by('id') \
+        .values('id', 'placed_at', 'payment_status', 'customer_id')
+    last_id = 0
+    while True:
+        batch = list(orders.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        items = {order['id']: [] for order in batch}
+        rows = item_model.objects \
+            .filter(order_id__in=list(items)) \
+            .order_by('order_id', 'id') \
+            .values('order_id', 'product_id', 'quantity', 'unit_price')
+        for item in rows:
+            items[item.pop('order_id')].append(item)
+        for order in batch:
+            yield order, items[order['id']]
+        last_id = batch[-1]['id']
+
+
+def export_csv(querysets, batch_size=1000):
+    """Yield CSV lines, one per order item; orders without items get one."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order, items in iter_orders(querysets, batch_size):
+        columns = [order['id'], order['placed_at'].isoformat(),
+                   order['payment_status'], order['customer_id']]
+        for item in items or [{}]:
+            yield writer.writerow(columns + [
+                item.get('product_id'), item.get('quantity'), item.get('unit_price')])
+
+
+def export_ndjson(querysets, batch_size=1000):
+    """Yield one JSON line per order, with its items nested."""
+    for order, items in iter_orders(querysets, batch_size):
+        # isoformat(), as in the CSV export; str() would drop the 'T'
+        order['placed_at'] = order['placed_at'].isoformat()
+        order['items'] = items
+        yield json.dumps(order, default=str) + '\n'
+
+
+def export_orders(querysets, format='csv', batch_size=1000):
+    """
+    Export the orders of `querysets`, a list of Order and ArchivedOrder
+    querysets, in `format`.
+    """
+    if format not in FORMATS:
+        raise ValueError(f'Unknown export format {format!r}.')
+    exporter = export_csv if format == 'csv' else export_ndjson
+    return exporter(querysets, batch_size)
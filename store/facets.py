@@ -0,0 +1,74 @@
+from collections import Counter
+from hashlib import md5
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db.models import BooleanField, Case, Count, IntegerField, Value, When
+from .caching import get_generations
+from .models import Product, TaxRate
+
+# Lower bounds of the unit_price histogram buckets; the last one is open.
+PRICE_BUCKETS = [0, 10, 25, 50, 100]
+
+# Query params that change the page but not the set of matching products
+NON_FILTER_PARAMS = {'cursor', 'limit', 'page', 'ordering', 'facets', 'fields', 'exclude'}
+
+FACETS_KEY = 'store:facets:{}'
+
+
+def get_price_bucket():
+    return Case(
+        *[When(unit_price__lt=upper, then=Value(index))
+          for index, upper in enumerate(PRICE_BUCKETS[1:])],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField())
+
+
+def compute_facets(queryset):
+    """
+    Count the products in `queryset` per collection, price bucket and stock
+    status with a single GROUP BY over the three of them.
+    """
+    rows = queryset \
+        .prefetch_related(None) \
+        .order_by() \
+        .annotate(
+            price_bucket=get_price_bucket(),
+            in_stock=Case(When(inventory__gt=0, then=Value(True)),
+                          default=Value(False), output_field=BooleanField())) \
+        .values('collection_id', 'price_bucket', 'in_stock') \
+        .annotate(count=Count('id'))
+
+    collections, buckets, in_stock = Counter(), Counter(), 0
+    for row in rows:
+        collections[row['collection_id']] += row['count']
+        buckets[row['price_bucket']] += row['count']
+        if row['in_stock']:
+            in_stock += row['count']
+
+    bounds = zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + [None])
+    return {
+        'collections': [{'id': id, 'count': count}
+                        for id, count in sorted(collections.items())],
+        'price': [{'min': lower, 'max': upper, 'count': buckets[index]}
+                  for index, (lower, upper) in enumerate(bounds)],
+        'in_stock': in_stock,
+    }
+
+
+def get_facets(queryset, request):
+    """
+    Facets for the filtered `queryset`, cached per filter set until the
+    next product or tax rate write (price_with_tax filters depend on both).
+    Facets group by collection id only, so collection writes don't matter.
+    """
+    params = sorted((key, values) for key, values in request.query_params.lists()
+                    if key not in NON_FILTER_PARAMS)
+    generations = get_generations([Product, TaxRate])
+    raw = f'{urlencode(params, doseq=True)}|{generations}'
+    key = FACETS_KEY.format(md5(raw.encode()).hexdigest())
+
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets)
+    return facets
@@ -1,10 +1,45 @@
-from django_filters.rest_framework import FilterSet
-from .models import Product
+from django_filters.rest_framework import FilterSet, NumberFilter
+from rest_framework.filters import OrderingFilter, SearchFilter
+from .models import Order, Product
+from .search import search_products
 
 class ProductFilter(FilterSet):
+  # Annotated by store.taxes.annotate_price_with_tax
+  price_with_tax__gt = NumberFilter(field_name='price_with_tax', lookup_expr='gt')
+  price_with_tax__lt = NumberFilter(field_name='price_with_tax', lookup_expr='lt')
+
   class Meta:
     model = Product
     fields = {
       'collection_id': ['exact'],
       'unit_price': ['gt', 'lt']
-    }
\ No newline at end of file
+    }
+
+
+class OrderFilter(FilterSet):
+  class Meta:
+    model = Order
+    # Served by the (payment_status, placed_at) and (placed_at) indexes
+    fields = {
+      'payment_status': ['exact'],
+      'placed_at': ['gte', 'lt']
+    }
+
+
+class ProductSearchFilter(SearchFilter):
+  """Looks terms up in the product search index instead of LIKE scans."""
+
+  def filter_queryset(self, request, queryset, view):
+    query = request.query_params.get(self.search_param, '')
+    if not query.strip():
+      return queryset
+    return search_products(queryset, query)
+
+
+class RelevanceOrderingFilter(OrderingFilter):
+  """Orders search results by relevance unless ?ordering= says otherwise."""
+
+  def get_default_ordering(self, view):
+    if view.request.query_params.get(SearchFilter.search_param, '').strip():
+      return ['-search_rank']
+    return super().get_default_ordering(view)
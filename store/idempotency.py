@@ -0,0 +1,106 @@
+import json
+import time
+from functools import wraps
+from hashlib import md5
+from uuid import uuid4
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+RESPONSE_KEY = 'store:idempotency:{}'
+LOCK_KEY = 'store:idempotency:{}:lock'
+
+# Stored responses are replayed for a day; a request holds the lock for at
+# most LOCK_TIMEOUT seconds, which is also how long duplicates wait for it.
+RESPONSE_TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+
+# Deletes the lock only if it still holds our token
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+
+
+def get_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return md5(body.encode()).hexdigest()
+
+
+def replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'detail': f'This {HEADER} was already used with a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored['data'], status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def release_lock(lock_key, token):
+    """
+    Free a lock taken with `token`. A request that outlived LOCK_TIMEOUT
+    may find the lock expired and taken by a duplicate, which must keep it.
+    """
+    client = getattr(cache, 'client', None)
+    if hasattr(client, 'get_client'):
+        # django_redis: compare and delete in one step
+        client.get_client(write=True).eval(
+            RELEASE_SCRIPT, 1, cache.make_key(lock_key), client.encode(token))
+    elif cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def idempotent(handler):
+    """
+    Make a view method safe to retry with an Idempotency-Key header. The
+    first request for a key runs the handler under a cache lock and
+    stores its response; retries, including ones that arrive while it is
+    still running, get that response back instead of running it again.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Keys are only unique per client and endpoint
+        scope = f'{request.user.pk}|{request.method}|{request.path}|{key}'
+        digest = md5(scope.encode()).hexdigest()
+        response_key, lock_key = RESPONSE_KEY.format(digest), LOCK_KEY.format(digest)
+        fingerprint = get_fingerprint(request)
+        token = uuid4().hex
+
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            stored = cache.get(response_key)
+            if stored is not None:
+                return replay(stored, fingerprint)
+            if cache.add(lock_key, token, LOCK_TIMEOUT):
+                break
+            if time.monotonic() >= deadline:
+                return Response(
+                    {'detail': f'A request with this {HEADER} is still in progress.'},
+                    status=status.HTTP_409_CONFLICT)
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = handler(self, request, *args, **kwargs)
+            # Server errors may be transient, so those retries run again
+            if response.status_code < 500:
+                cache.set(response_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data,
+                }, RESPONSE_TIMEOUT)
+            return response
+        finally:
+            release_lock(lock_key, token)
+    return wrapper
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from store.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Moves complete orders older than ORDER_ARCHIVE_AGE to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age', type=int, default=settings.ORDER_ARCHIVE_AGE,
+                            help='Age in seconds after which a complete order is archived')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        archived = archive_orders(options['age'], options['batch_size'])
+        print(f'{archived} orders archived.')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from store.models import ArchivedOrder, Customer, CustomerHistory, Order
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the customer order-history summaries from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        has_orders = Exists(Order.objects.filter(customer_id=OuterRef('pk'))) | \
+            Exists(ArchivedOrder.objects.filter(customer_id=OuterRef('pk')))
+        customer_ids = Customer.objects \
+            .filter(has_orders) \
+            .order_by('id') \
+            .values_list('id', flat=True)
+        count, last_id = 0, 0
+        while True:
+            batch = list(customer_ids.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            CustomerHistory.objects.rebuild(batch)
+            count += len(batch)
+            last_id = batch[-1]
+        print(f'{count} customer histories rebuilt.')
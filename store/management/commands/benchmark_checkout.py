@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.exceptions import ValidationError
+from core.models import User
+from store.models import Cart, CartItem, Collection, Order, OrderItem, OutboxEvent, Product
+from store.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Runs concurrent checkouts against one scarce product and checks for oversell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--inventory', type=int, default=100)
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        run = uuid4().hex[:8]
+        collection = Collection.objects.create(title=f'benchmark {run}')
+        product = Product.objects.create(
+            title=f'benchmark {run}', slug=f'benchmark-{run}', unit_price=1,
+            inventory=options['inventory'], collection=collection)
+        buyers = []
+        for index in range(options['buyers']):
+            user = User.objects.create(
+                username=f'benchmark-{run}-{index}', email=f'benchmark-{run}-{index}@example.com')
+            cart = Cart.objects.create()
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            buyers.append((user.id, cart.id))
+
+        def checkout(buyer):
+            user_id, cart_id = buyer
+            serializer = CreateOrderSerializer(
+                data={'cart_id': cart_id}, context={'user_id': user_id})
+            try:
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+                return True
+            except ValidationError:
+                return False
+            finally:
+                connection.close()
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                results = list(executor.map(checkout, buyers))
+            elapsed = time.perf_counter() - start
+
+            product.refresh_from_db()
+            sold = OrderItem.objects.filter(product=product).count()
+            print(f'{len(buyers)} checkouts on {options["threads"]} threads in {elapsed:.2f}s '
+                  f'({len(buyers) / elapsed:.0f}/s)')
+            print(f'{results.count(True)} succeeded, {results.count(False)} rejected for stock')
+            print(f'{sold} sold, {product.inventory} left of {options["inventory"]}, '
+                  f'oversold by {max(sold - options["inventory"], 0)}')
+        finally:
+            orders = list(Order.objects
+                          .filter(items__product=product)
+                          .values_list('id', flat=True))
+            OutboxEvent.objects \
+                .filter(topic='order_created', payload__order_id__in=orders) \
+                .delete()
+            OrderItem.objects.filter(order_id__in=orders).delete()
+            Order.objects.filter(pk__in=orders).delete()
+            Cart.objects.filter(items__product=product).delete()
+            User.objects.filter(username__startswith=f'benchmark-{run}-').delete()
+            product.delete()
+            collection.delete()
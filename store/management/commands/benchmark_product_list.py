@@ -0,0 +1,51 @@
+import timeit
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from store.models import Product, ProductImage
+from store.serializers import ProductRowSerializer, ProductSerializer
+from store.taxes import annotate_price_with_tax
+
+
+class Command(BaseCommand):
+    help = 'Compares ProductSerializer with ProductRowSerializer on list pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+',
+                            default=[10, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        request = APIRequestFactory().get('/store/api/products/', HTTP_HOST='localhost')
+        context = {'request': Request(request)}
+        renderer = JSONRenderer()
+        queryset = annotate_price_with_tax(Product.objects.order_by('id'))
+        images = ProductImage.objects.order_by('id')
+
+        available = queryset.count()
+        print(f'{"rows":>6} {"serializer ms":>14} {"rows ms":>10} {"speedup":>8}')
+        for rows in options['rows']:
+            if rows > available:
+                print(f'{rows:>6} skipped, only {available} products (run seed_db)')
+                continue
+
+            def serializer_path():
+                page = queryset.prefetch_related(
+                    Prefetch('images', queryset=images))[:rows]
+                return renderer.render(
+                    ProductSerializer(page, many=True, context=context).data)
+
+            def rows_path():
+                page = queryset.values()[:rows]
+                return renderer.render(
+                    ProductRowSerializer(page, many=True, context=context).data)
+
+            if serializer_path() != rows_path():
+                raise AssertionError(f'Outputs differ at {rows} rows')
+
+            repeat = options['repeat']
+            slow = min(timeit.repeat(serializer_path, number=1, repeat=repeat))
+            fast = min(timeit.repeat(rows_path, number=1, repeat=repeat))
+            print(f'{rows:>6} {slow * 1000:>14.2f} {fast * 1000:>10.2f} {slow / fast:>7.1f}x')
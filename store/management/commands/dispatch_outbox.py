@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.outbox import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Delivers pending outbox events to their receivers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        delivered = dispatch(options['batch_size'])
+        print(f'{delivered} events delivered.')
@@ -0,0 +1,40 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from store.exports import FORMATS, export_orders
+from store.models import ArchivedOrder, Order
+
+
+class Command(BaseCommand):
+    help = 'Streams orders with their items as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--status', choices=[choice for choice, _ in Order.PAYMENT_STATUS_CHOICES])
+        parser.add_argument('--since', help='Placed at or after this ISO datetime')
+        parser.add_argument('--until', help='Placed before this ISO datetime')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        filters = {}
+        if options['status']:
+            filters['payment_status'] = options['status']
+        for option, lookup in [('since', 'placed_at__gte'), ('until', 'placed_at__lt')]:
+            if options[option]:
+                value = parse_datetime(options[option])
+                if value is None:
+                    raise CommandError(f'--{option} must be an ISO datetime.')
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                filters[lookup] = value
+
+        # Old complete orders have moved to the archive
+        querysets = [model.objects.filter(**filters) for model in [Order, ArchivedOrder]]
+        lines = export_orders(querysets, options['format'], options['batch_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as file:
+                file.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.carts import get_cart_store
+
+
+class Command(BaseCommand):
+    help = 'Writes every cart held in Redis to the Cart/CartItem tables'
+
+    def handle(self, *args, **options):
+        cart_store = get_cart_store()
+        if cart_store is None:
+            raise CommandError("CART_ENGINE is 'db'; carts are already in the database.")
+        count = cart_store.flush_all()
+        print(f'{count} carts flushed.')
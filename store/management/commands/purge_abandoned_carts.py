@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from store.carts import purge_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = 'Deletes carts that have been idle for longer than CART_TIMEOUT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age', type=int, default=settings.CART_TIMEOUT,
+                            help='Idle time in seconds after which a cart is purged')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        purged = purge_abandoned_carts(options['age'], options['batch_size'])
+        print(f'{purged} abandoned carts purged.')
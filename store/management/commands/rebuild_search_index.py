@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from store.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from the catalog'
+
+    def handle(self, *args, **options):
+        print('Rebuilding the search index...')
+        count = rebuild_index()
+        print(f'{count} products indexed.')
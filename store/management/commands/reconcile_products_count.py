@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+from store.caching import invalidate
+from store.models import Collection
+
+
+class Command(BaseCommand):
+    help = 'Recounts Collection.products_count where it drifted from the products table'
+
+    def handle(self, *args, **options):
+        drifted = Collection.objects \
+            .annotate(actual=Count('products')) \
+            .exclude(products_count=F('actual')) \
+            .values_list('id', flat=True)
+        drifted = list(drifted)
+        Collection.objects.filter(pk__in=drifted).refresh_products_count()
+        if drifted:
+            # update() sends no signals, so cached collections keep the old counts
+            invalidate(Collection)
+        print(f'{len(drifted)} collections reconciled.')
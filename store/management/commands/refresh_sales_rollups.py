@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from store.reports import refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Folds orders created or changed since the last run into the sales rollups'
+
+    def handle(self, *args, **options):
+        days = refresh_sales_rollups()
+        print(f'{days} days refolded.')
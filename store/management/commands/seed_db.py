@@ -2,6 +2,9 @@ from django.core.management.base import BaseCommand
 from django.db import connection
 from pathlib import Path
 import os
+from store.caching import invalidate
+from store.models import Collection, Product
+from store.search import rebuild_index
 from store.utils import execute_sql_script
 
 
@@ -18,4 +21,10 @@ class Command(BaseCommand):
             #            cursor.execute(sql)
             execute_sql_script(cursor, sql)
 
+        # Raw inserts bypass the Product signals that maintain the index,
+        # the collection counters and the response cache
+        rebuild_index()
+        Collection.objects.refresh_products_count()
+        invalidate(Collection, Product)
+
         print('Database populated successfully.')
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_search_index(apps, schema_editor):
+    from store.search import get_term_weights
+
+    Product = apps.get_model('store', 'Product')
+    ProductSearchTerm = apps.get_model('store', 'ProductSearchTerm')
+    products = Product.objects.only('id', 'title', 'description')
+    for product in products.iterator(chunk_size=1000):
+        ProductSearchTerm.objects.bulk_create([
+            ProductSearchTerm(product_id=product.id, term=term, weight=weight)
+            for term, weight in get_term_weights(product).items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveSmallIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='store.product')),
+            ],
+            options={
+                'unique_together': {('term', 'product')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:43
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_totals(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    items = CartItem.objects \
+        .filter(cart_id=OuterRef('pk')) \
+        .order_by() \
+        .values('cart_id')
+    count = items.annotate(total=Sum('quantity')).values('total')
+    subtotal = items \
+        .annotate(total=Sum(F('quantity') * F('product__unit_price'))) \
+        .values('total')
+    Cart.objects.update(
+        items_count=Coalesce(Subquery(count), 0),
+        subtotal=Coalesce(Subquery(subtotal), Decimal(0),
+                          output_field=DecimalField(max_digits=9, decimal_places=2)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_collection_products_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(db_default=0, decimal_places=2, default=0, editable=False, max_digits=9),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:45
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_last_activity(apps, schema_editor):
+    # AddField stamped every cart with the migration time; created_at is
+    # the best activity time we have, so abandoned carts stay purgeable.
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(last_activity=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_cart_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:56
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerHistory',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='history', serialize=False, to='store.customer')),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('last_order_at', models.DateTimeField(null=True)),
+                ('top_products', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.customer')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', '-quantity'], name='store_custo_custome_fed93b_idx')],
+                'unique_together': {('customer', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_customerhistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('orders', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('orders', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReportWatermark',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('value', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='last_update',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['last_update'], name='store_order_last_up_c2e120_idx'),
+        ),
+        migrations.AddField(
+            model_name='collectionsales',
+            name='collection',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.collection'),
+        ),
+        migrations.AddField(
+            model_name='productsales',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='collectionsales',
+            unique_together={('date', 'collection')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='productsales',
+            unique_together={('date', 'product')},
+        ),
+    ]
@@ -1,9 +1,16 @@
 from django.contrib import admin
 from django.conf import settings
+from collections import Counter
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, DecimalField, Exists, F, IntegerField, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from decimal import Decimal
 from uuid import uuid4
 
+from store.caching import invalidate
 from store.validators import validate_file_size
 
 
@@ -12,10 +19,33 @@ class Promotion(models.Model):
     discount = models.FloatField()
 
 
+class CollectionQuerySet(models.QuerySet):
+    def add_products_count(self, counts):
+        """Apply {collection_id: delta} to the stored products_count."""
+        for collection_id, delta in counts.items():
+            if delta:
+                self.filter(pk=collection_id).update(
+                    products_count=F('products_count') + delta)
+
+    def refresh_products_count(self):
+        products = Product.objects \
+            .filter(collection_id=OuterRef('pk')) \
+            .order_by() \
+            .values('collection_id') \
+            .annotate(count=Count('id')) \
+            .values('count')
+        return self.update(products_count=Coalesce(Subquery(products), 0))
+
+
 class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    # Maintained by the Product signals and ProductQuerySet
+    products_count = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False)
+
+    objects = CollectionQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
@@ -24,6 +54,86 @@ class Collection(models.Model):
         ordering = ['title']
 
 
+class InsufficientInventory(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough inventory for products {product_ids}')
+        self.product_ids = product_ids
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Keeps Collection.products_count and cached responses in step on the
+    bulk paths that bypass model signals.
+    """
+
+    def reserve(self, quantities):
+        """
+        Take {product_id: quantity} out of inventory with one conditional
+        UPDATE ... SET inventory = inventory - q WHERE inventory >= q. The
+        rows are locked in primary key order, the same for every checkout,
+        so concurrent reservations queue instead of deadlocking. Raises
+        InsufficientInventory, leaving inventory untouched, unless every
+        line fits.
+        """
+        needed = Case(
+            *[When(pk=product_id, then=Value(quantity))
+              for product_id, quantity in sorted(quantities.items())],
+            output_field=IntegerField())
+        try:
+            with transaction.atomic(using=self.db):
+                reserved = self \
+                    .filter(pk__in=quantities, inventory__gte=needed) \
+                    .update(inventory=F('inventory') - needed,
+                            last_update=timezone.now())
+                if reserved != len(quantities):
+                    # Raising out of the block undoes the partial UPDATE
+                    raise InsufficientInventory([])
+        except InsufficientInventory:
+            available = dict(self
+                             .filter(pk__in=quantities)
+                             .values_list('id', 'inventory'))
+            raise InsufficientInventory(sorted(
+                product_id for product_id, quantity in quantities.items()
+                if available.get(product_id, 0) < quantity))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        counts = Counter(obj.collection_id for obj in objs)
+        if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+            # We can't tell which rows were actually inserted
+            Collection.objects.filter(pk__in=counts).refresh_products_count()
+        else:
+            Collection.objects.add_products_count(counts)
+        invalidate(Product)
+        return objs
+
+    def update(self, **kwargs):
+        moves = 'collection' in kwargs or 'collection_id' in kwargs
+        reprices = 'unit_price' in kwargs
+        if not moves and not reprices:
+            rows = super().update(**kwargs)
+        else:
+            # Capture what the update affects before it changes the filter
+            with transaction.atomic(using=self.db):
+                if moves:
+                    collections = set(self.values_list('collection_id', flat=True).distinct())
+                if reprices:
+                    carts = CartItem.objects \
+                        .filter(product__in=self.values('pk')) \
+                        .values_list('cart_id', flat=True) \
+                        .distinct()
+                    carts = list(carts)
+                rows = super().update(**kwargs)
+                if moves:
+                    collection = kwargs.get('collection_id', kwargs.get('collection'))
+                    collections.add(getattr(collection, 'pk', collection))
+                    Collection.objects.filter(pk__in=collections).refresh_products_count()
+                if reprices:
+                    Cart.objects.filter(pk__in=carts).refresh_totals(touch=False)
+        invalidate(Product)
+        return rows
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -38,11 +148,55 @@ class Product(models.Model):
         Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['unit_price', 'id']),
+            models.Index(fields=['last_update', 'id']),
+        ]
+
+
+class TaxRate(models.Model):
+    region = models.CharField(max_length=10, blank=True)
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, null=True, blank=True, related_name='tax_rates')
+    rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=4,
+        validators=[MinValueValidator(0)])
+
+    def __str__(self) -> str:
+        return f'{self.region or "*"} / {self.collection or "*"}: {self.rate}'
+
+    def clean(self):
+        # unique_together can't catch these: NULL collections never collide,
+        # and MySQL has no partial unique indexes to enforce it instead.
+        if self.collection_id is None:
+            duplicates = TaxRate.objects \
+                .filter(region=self.region, collection__isnull=True) \
+                .exclude(pk=self.pk)
+            if duplicates.exists():
+                raise ValidationError(
+                    'A catch-all rate for this region already exists.')
+
+    class Meta:
+        unique_together = [['region', 'collection']]
+
+
+class ProductSearchTerm(models.Model):
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = [['term', 'product']]
 
 
 class ProductImage(models.Model):
@@ -87,6 +241,33 @@ class Customer(models.Model):
         ]
 
 
+class OrderQuerySet(models.QuerySet):
+    def transition_payment_status(self, status):
+        """
+        Move the orders that may go to `status` from their current one (see
+        Order.PAYMENT_STATUS_TRANSITIONS) with one UPDATE, and return their
+        ids. The others are left alone.
+        """
+        allowed = Order.PAYMENT_STATUS_TRANSITIONS.get(status, [])
+        with transaction.atomic():
+            previous = self \
+                .filter(payment_status__in=allowed) \
+                .select_for_update() \
+                .order_by('id') \
+                .values_list('id', 'payment_status')
+            previous = list(previous)
+            order_ids = [order_id for order_id, _ in previous]
+            # The status is checked again by the UPDATE itself
+            Order.objects \
+                .filter(pk__in=order_ids, payment_status__in=allowed) \
+                .update(payment_status=status, last_update=timezone.now())
+            for previous_status in allowed:
+                CustomerHistory.objects.record_payment_status(
+                    [order_id for order_id, old in previous if old == previous_status],
+                    previous_status, status)
+        return order_ids
+
+
 class Order(models.Model):
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
@@ -96,16 +277,34 @@ class Order(models.Model):
         (PAYMENT_STATUS_COMPLETE, 'Complete'),
         (PAYMENT_STATUS_FAILED, 'Failed')
     ]
+    # status -> the statuses an order may reach it from in bulk
+    PAYMENT_STATUS_TRANSITIONS = {
+        PAYMENT_STATUS_COMPLETE: [PAYMENT_STATUS_PENDING, PAYMENT_STATUS_FAILED],
+        PAYMENT_STATUS_FAILED: [PAYMENT_STATUS_PENDING],
+        PAYMENT_STATUS_PENDING: [PAYMENT_STATUS_FAILED],
+    }
 
     placed_at = models.DateTimeField(auto_now_add=True)
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    # Bulk updates must set it too: the sales rollups find changes with it
+    last_update = models.DateTimeField(auto_now=True)
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         permissions = [
             ('cancel_order', 'Can cancel order')
         ]
+        indexes = [
+            # Customer history, newest first
+            models.Index(fields=['customer', 'placed_at']),
+            # Staff listings, filtered by status and/or date range
+            models.Index(fields=['payment_status', 'placed_at']),
+            models.Index(fields=['placed_at']),
+            models.Index(fields=['last_update']),
+        ]
 
 
 class OrderItem(models.Model):
@@ -117,6 +316,185 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
 
+class ArchivedOrder(models.Model):
+    """
+    A complete order moved out of Order by store.archive, keeping its id.
+    Archived orders are read-only.
+    """
+    placed_at = models.DateTimeField()
+    payment_status = models.CharField(
+        max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    customer = models.ForeignKey(
+        Customer, on_delete=models.PROTECT, related_name='+')
+    last_update = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'placed_at']),
+            models.Index(fields=['placed_at']),
+        ]
+
+
+class ArchivedOrderItem(models.Model):
+    order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.PROTECT, related_name='items')
+    product = models.ForeignKey(
+        Product, on_delete=models.PROTECT, related_name='+')
+    quantity = models.PositiveSmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+
+
+class CustomerHistoryQuerySet(models.QuerySet):
+    def record_order(self, order, items):
+        """
+        Count a new order and its items into its customer's summary. Call
+        it in the transaction that creates the order, so it runs once.
+        """
+        customer_id = order.customer_id
+        total = sum((item.quantity * item.unit_price for item in items), Decimal(0))
+        spent = total if order.payment_status == Order.PAYMENT_STATUS_COMPLETE else 0
+        placed_at = Value(order.placed_at)
+        self.get_or_create(customer_id=customer_id)
+        self.filter(pk=customer_id).update(
+            orders_count=F('orders_count') + 1,
+            total_spent=F('total_spent') + spent,
+            last_order_at=Coalesce(Greatest('last_order_at', placed_at), placed_at))
+
+        quantities = Counter()
+        for item in items:
+            quantities[item.product_id] += item.quantity
+        if quantities:
+            CustomerProduct.objects.bulk_create([
+                CustomerProduct(customer_id=customer_id, product_id=product_id)
+                for product_id in quantities
+            ], ignore_conflicts=True)
+            added = Case(*[When(product_id=product_id, then=Value(quantity))
+                           for product_id, quantity in quantities.items()],
+                         output_field=IntegerField())
+            CustomerProduct.objects \
+                .filter(customer_id=customer_id, product_id__in=list(quantities)) \
+                .update(quantity=F('quantity') + added)
+        self.filter(pk=customer_id).refresh_top_products()
+
+    def record_payment_status(self, order_ids, previous, status):
+        """
+        Move the totals of orders whose payment_status went from `previous`
+        to `status` into or out of total_spent.
+        """
+        complete = Order.PAYMENT_STATUS_COMPLETE
+        if (previous == complete) == (status == complete):
+            return
+        sign = 1 if status == complete else -1
+        totals = OrderItem.objects \
+            .filter(order_id__in=order_ids) \
+            .order_by() \
+            .values('order__customer_id') \
+            .annotate(total=Sum(F('quantity') * F('unit_price'))) \
+            .values_list('order__customer_id', 'total')
+        self.add_spent({customer_id: sign * total for customer_id, total in totals})
+
+    def add_spent(self, totals):
+        """Apply {customer_id: delta} to the stored total_spent."""
+        for customer_id, delta in totals.items():
+            if delta:
+                self.filter(pk=customer_id).update(
+                    total_spent=F('total_spent') + delta)
+
+    def refresh_top_products(self):
+        for customer_id in self.values_list('pk', flat=True):
+            top_products = CustomerProduct.objects \
+                .filter(customer_id=customer_id) \
+                .order_by('-quantity', 'product_id') \
+                .values('product_id', 'quantity', title=F('product__title'))
+            self.filter(pk=customer_id).update(
+                top_products=list(top_products[:CustomerHistory.TOP_PRODUCTS]))
+
+    def rebuild(self, customer_ids):
+        """
+        Recompute the summaries of the given customers from their orders,
+        archived ones included. Orders placed while it runs may be missed;
+        rebuilding again is safe and picks them up.
+        """
+        customer_ids = list(customer_ids)
+        quantities = Counter()
+        histories = {}
+        for order_model, item_model in [(Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)]:
+            items = item_model.objects \
+                .filter(order__customer_id__in=customer_ids) \
+                .order_by() \
+                .values_list('order__customer_id', 'product_id') \
+                .annotate(quantity=Sum('quantity'))
+            for customer_id, product_id, quantity in items:
+                quantities[customer_id, product_id] += quantity
+
+            orders = order_model.objects \
+                .filter(customer_id__in=customer_ids) \
+                .order_by() \
+                .values_list('customer_id') \
+                .annotate(count=Count('id'), last=Max('placed_at'))
+            for customer_id, count, last in orders:
+                history = histories.setdefault(customer_id, CustomerHistory(customer_id=customer_id))
+                history.orders_count += count
+                if history.last_order_at is None or last > history.last_order_at:
+                    history.last_order_at = last
+
+            spent = item_model.objects \
+                .filter(order__customer_id__in=customer_ids,
+                        order__payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+                .order_by() \
+                .values_list('order__customer_id') \
+                .annotate(total=Sum(F('quantity') * F('unit_price')))
+            for customer_id, total in spent:
+                histories[customer_id].total_spent += total
+
+        with transaction.atomic():
+            CustomerProduct.objects.filter(customer_id__in=customer_ids).delete()
+            CustomerProduct.objects.bulk_create([
+                CustomerProduct(customer_id=customer_id, product_id=product_id, quantity=quantity)
+                for (customer_id, product_id), quantity in quantities.items()
+            ])
+            self.filter(customer_id__in=customer_ids).delete()
+            self.bulk_create(histories.values())
+            self.filter(customer_id__in=customer_ids).refresh_top_products()
+
+
+class CustomerHistory(models.Model):
+    """
+    Lifetime order summary of a customer, kept current by checkout and by
+    payment status changes so reading it is a primary key lookup. The
+    backfill_customer_history command rebuilds it from the orders.
+    """
+    TOP_PRODUCTS = 5
+
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name='history')
+    orders_count = models.PositiveIntegerField(default=0)
+    # Complete orders only
+    total_spent = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal(0))
+    last_order_at = models.DateTimeField(null=True)
+    # The TOP_PRODUCTS most bought as [{product_id, title, quantity}]
+    top_products = models.JSONField(default=list)
+
+    objects = CustomerHistoryQuerySet.as_manager()
+
+
+class CustomerProduct(models.Model):
+    """How many of a product a customer has ordered, for top_products."""
+    customer = models.ForeignKey(
+        Customer, on_delete=models.CASCADE, related_name='+')
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['customer', 'product']]
+        indexes = [
+            models.Index(fields=['customer', '-quantity']),
+        ]
+
+
 class Address(models.Model):
     street = models.CharField(max_length=255)
     city = models.CharField(max_length=255)
@@ -124,9 +502,114 @@ class Address(models.Model):
         Customer, on_delete=models.CASCADE)
 
 
+class CartQuerySet(models.QuerySet):
+    def add_to_totals(self, quantity, unit_price):
+        return self.update(items_count=F('items_count') + quantity,
+                           subtotal=F('subtotal') + quantity * unit_price,
+                           last_activity=timezone.now())
+
+    def refresh_totals(self, touch=True):
+        """
+        Recompute the totals from the lines. Pass touch=False when the cart
+        changed without its owner doing anything, e.g. a product repricing.
+
+        Deleting lines doesn't refresh the totals: a CartItem post_delete
+        handler would disable fast deletes and cost an UPDATE per line on
+        every checkout and purge, where the cart goes too. Code that deletes
+        lines of a cart that stays must call this afterwards.
+        """
+        items = CartItem.objects \
+            .filter(cart_id=OuterRef('pk')) \
+            .order_by() \
+            .values('cart_id')
+        count = items.annotate(total=Sum('quantity')).values('total')
+        subtotal = items \
+            .annotate(total=Sum(F('quantity') * F('product__unit_price'))) \
+            .values('total')
+        totals = {
+            'items_count': Coalesce(Subquery(count), 0),
+            'subtotal': Coalesce(Subquery(subtotal), Decimal(0),
+                                 output_field=DecimalField(max_digits=9, decimal_places=2)),
+        }
+        if touch:
+            totals['last_activity'] = timezone.now()
+        return self.update(**totals)
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained by CartItemQuerySet, the cart serializers and the signals
+    items_count = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False)
+    subtotal = models.DecimalField(
+        max_digits=9, decimal_places=2, default=0, db_default=0, editable=False)
+    # Bumped with the totals; carts idle past CART_TIMEOUT get purged
+    last_activity = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = CartQuerySet.as_manager()
+
+
+class CartItemQuerySet(models.QuerySet):
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Add `quantity` of a product to a cart in one INSERT ... SELECT that
+        increments the existing line on conflict, so concurrent adds never
+        lose updates. Selecting from the product and cart tables makes the
+        statement insert nothing when either is missing; returns None then.
+
+        The cart totals are bumped first, in the same transaction, so the
+        cart row is locked before the line and concurrent adds queue on it
+        instead of deadlocking.
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            price = Product.objects.filter(pk=product_id).order_by().values('unit_price')
+            updated = Cart.objects \
+                .filter(pk=cart_id) \
+                .filter(Exists(price)) \
+                .add_to_totals(quantity, Subquery(price))
+            if not updated:
+                return None
+            return self.upsert_quantity(cart_id, product_id, quantity)
+
+    def upsert_quantity(self, cart_id, product_id, quantity):
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(CartItem._meta.db_table)
+        db_cart_id = Cart._meta.pk.get_db_prep_value(cart_id, connection)
+        if connection.vendor == 'mysql':
+            # Qualified: the SELECTed tables have an id column too
+            upsert = (f'ON DUPLICATE KEY UPDATE {table}.{qn("id")} = LAST_INSERT_ID({table}.{qn("id")}), '
+                      f'{table}.{qn("quantity")} = {table}.{qn("quantity")} + %s')
+        else:
+            upsert = (f'ON CONFLICT ({qn("cart_id")}, {qn("product_id")}) DO UPDATE '
+                      f'SET {qn("quantity")} = {table}.{qn("quantity")} + %s')
+        returning = ''
+        if connection.features.can_return_columns_from_insert:
+            returning, _ = connection.ops.return_insert_columns(
+                [CartItem._meta.pk, CartItem._meta.get_field('quantity')])
+        sql = (
+            f'INSERT INTO {table} ({qn("cart_id")}, {qn("product_id")}, {qn("quantity")}) '
+            f'SELECT {qn(Cart._meta.db_table)}.{qn("id")}, {qn(Product._meta.db_table)}.{qn("id")}, %s '
+            f'FROM {qn(Cart._meta.db_table)}, {qn(Product._meta.db_table)} '
+            f'WHERE {qn(Cart._meta.db_table)}.{qn("id")} = %s '
+            f'AND {qn(Product._meta.db_table)}.{qn("id")} = %s '
+            f'{upsert} {returning}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [quantity, db_cart_id, product_id, quantity])
+            if returning:
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                id, quantity = row
+            elif not cursor.rowcount:
+                return None
+            else:
+                # MySQL has no RETURNING; LAST_INSERT_ID(id) exposes the row
+                id = cursor.lastrowid
+                quantity = self.filter(pk=id).values_list('quantity', flat=True).get()
+        return CartItem(id=id, cart_id=cart_id, product_id=product_id, quantity=quantity)
 
 
 class CartItem(models.Model):
@@ -137,6 +620,8 @@ class CartItem(models.Model):
         validators=[MinValueValidator(1)]
     )
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
@@ -147,3 +632,54 @@ class Review(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
+
+
+class OutboxEvent(models.Model):
+    """
+    An event written in the same transaction as the change it describes
+    and delivered afterwards by store.outbox.dispatch. Rows are deleted
+    once delivered.
+    """
+    topic = models.CharField(max_length=64)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at', 'id']),
+        ]
+
+
+class ProductSales(models.Model):
+    """Complete orders' sales of a product on one day, see store.reports."""
+    date = models.DateField()
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='+')
+    units = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+    orders = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['date', 'product']]
+
+
+class CollectionSales(models.Model):
+    """Complete orders' sales of a collection on one day, see store.reports."""
+    date = models.DateField()
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, related_name='+')
+    units = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+    orders = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['date', 'collection']]
+
+
+class ReportWatermark(models.Model):
+    """How far a report job has folded in changes, by job name."""
+    name = models.CharField(max_length=64, primary_key=True)
+    value = models.DateTimeField()
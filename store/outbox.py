@@ -0,0 +1,90 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Order, OutboxEvent
+from .signals import order_created, payment_status_changed
+
+MAX_ATTEMPTS = 10
+# How long a claimed event stays invisible to other dispatchers
+LEASE = timedelta(minutes=5)
+MAX_BACKOFF = timedelta(hours=1)
+
+
+def load_order_created(payload):
+    return {'order': Order.objects.prefetch_related('items').get(pk=payload['order_id'])}
+
+
+def load_payment_status_changed(payload):
+    # {payment_status: [order ids]}, as recorded
+    return {'changes': payload['changes']}
+
+
+# topic -> (signal whose receivers handle it, payload -> signal kwargs)
+TOPICS = {
+    'order_created': (order_created, load_order_created),
+    'payment_status_changed': (payment_status_changed, load_payment_status_changed),
+}
+
+
+def publish(topic, **payload):
+    """
+    Record an event in the current transaction. It is delivered only if
+    that transaction commits, and whatever the receivers do adds nothing
+    to its latency.
+    """
+    if topic not in TOPICS:
+        raise ValueError(f'Unknown outbox topic {topic!r}.')
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def claim(batch_size):
+    """
+    Lease up to `batch_size` due events. SKIP LOCKED lets several
+    dispatchers drain the table side by side without sharing events.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = OutboxEvent.objects \
+            .select_for_update(skip_locked=True) \
+            .filter(next_attempt_at__lte=now, attempts__lt=MAX_ATTEMPTS) \
+            .order_by('next_attempt_at', 'id')
+        events = list(events[:batch_size])
+        OutboxEvent.objects \
+            .filter(pk__in=[event.pk for event in events]) \
+            .update(next_attempt_at=now + LEASE, attempts=F('attempts') + 1)
+    return events
+
+
+def deliver(event):
+    signal, load = TOPICS[event.topic]
+    responses = signal.send_robust(OutboxEvent, **load(event.payload))
+    errors = [response for _, response in responses if isinstance(response, Exception)]
+    if errors:
+        raise errors[0]
+
+
+def dispatch(batch_size=100):
+    """
+    Deliver due events in batches until none are left and return how many
+    were delivered. An event whose receivers fail is retried, whole, with
+    exponential backoff until MAX_ATTEMPTS, so receivers must tolerate
+    seeing an event twice.
+    """
+    delivered = 0
+    while True:
+        events = claim(batch_size)
+        for event in events:
+            try:
+                deliver(event)
+            except Exception as error:
+                backoff = min(timedelta(seconds=10 * 2 ** event.attempts), MAX_BACKOFF)
+                OutboxEvent.objects \
+                    .filter(pk=event.pk) \
+                    .update(next_attempt_at=timezone.now() + backoff,
+                            last_error=repr(error))
+            else:
+                OutboxEvent.objects.filter(pk=event.pk).delete()
+                delivered += 1
+        if len(events) < batch_size:
+            return delivered
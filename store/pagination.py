@@ -1,4 +1,128 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
 
 class DefaultPagination(PageNumberPagination):
-  page_size = 10
\ No newline at end of file
+  page_size = 10
+
+
+class KeysetPagination(CursorPagination):
+  """
+  Seeks on (ordering field, id) instead of OFFSET, so every page costs the
+  same and no COUNT(*) is ever issued. Cursors are opaque to clients.
+  """
+  page_size = 10
+  page_size_query_param = 'limit'
+  max_page_size = 100
+  ordering = 'title'
+  tie_breaker = 'id'
+
+  def get_ordering(self, request, queryset, view):
+    # Only the leading field is seekable; id makes the ordering total.
+    field = super().get_ordering(request, queryset, view)[0]
+    if field.lstrip('-') == self.tie_breaker:
+      return (field,)
+    direction = '-' if field.startswith('-') else ''
+    return (field, direction + self.tie_breaker)
+
+  def paginate_queryset(self, queryset, request, view=None):
+    return self.paginate_querysets([queryset], request, view)
+
+  def paginate_querysets(self, querysets, request, view=None):
+    """
+    Paginate the union of `querysets`, which must share the ordering
+    fields and not overlap: each is seeked and cut to a page on its own,
+    then the rows are merged in Python.
+    """
+    self.request = request
+    self.page_size = self.get_page_size(request)
+    if not self.page_size:
+      return None
+
+    self.base_url = request.build_absolute_uri()
+    self.ordering = self.get_ordering(request, querysets[0], view)
+    self.cursor = self.decode_cursor(request)
+    reverse = self.cursor is not None and self.cursor.reverse
+
+    ordering = self._reverse_ordering(self.ordering) if reverse else self.ordering
+    results = []
+    for queryset in querysets:
+      queryset = queryset.order_by(*ordering)
+      if self.cursor is not None and self.cursor.position is not None:
+        try:
+          queryset = queryset.filter(self._seek(ordering, self.cursor.position))
+        except (ValidationError, TypeError, ValueError):
+          raise NotFound(self.invalid_cursor_message)
+      results += queryset[:self.page_size + 1]
+    if len(querysets) > 1:
+      # Stable sorts, least significant field first
+      for field in reversed(ordering):
+        name = field.lstrip('-')
+        results.sort(key=lambda row: row[name] if isinstance(row, dict) else getattr(row, name),
+                     reverse=field.startswith('-'))
+      results = results[:self.page_size + 1]
+
+    has_more = len(results) > self.page_size
+    self.page = results[:self.page_size]
+
+    if reverse:
+      self.page.reverse()
+      self.has_next, self.has_previous = True, has_more
+    else:
+      self.has_next, self.has_previous = has_more, self.cursor is not None
+
+    return self.page
+
+  def get_next_link(self):
+    if not self.has_next:
+      return None
+    if self.page:
+      position = self._get_position_from_instance(self.page[-1], self.ordering)
+    else:
+      position = self.cursor.position
+    return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+  def get_previous_link(self):
+    if not self.has_previous:
+      return None
+    if self.page:
+      position = self._get_position_from_instance(self.page[0], self.ordering)
+    else:
+      position = self.cursor.position
+    return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+  def _get_position_from_instance(self, instance, ordering):
+    values = []
+    for field in ordering:
+      name = field.lstrip('-')
+      values.append(instance[name] if isinstance(instance, dict) else getattr(instance, name))
+    # str() keeps full precision for Decimal and microseconds for datetime.
+    return json.dumps(values, default=str)
+
+  def _seek(self, ordering, position):
+    try:
+      values = json.loads(position)
+    except ValueError:
+      raise NotFound(self.invalid_cursor_message)
+    if not isinstance(values, list) or len(values) != len(ordering):
+      raise NotFound(self.invalid_cursor_message)
+
+    # Row-value comparison spelled out: (a > x) OR (a = x AND b > y)
+    condition, equal = Q(), Q()
+    for field, value in zip(ordering, values):
+      name = field.lstrip('-')
+      lookup = 'lt' if field.startswith('-') else 'gt'
+      condition |= equal & Q(**{f'{name}__{lookup}': value})
+      equal &= Q(**{name: value})
+    return condition
+
+  def _reverse_ordering(self, ordering):
+    return tuple(field[1:] if field.startswith('-') else '-' + field
+                 for field in ordering)
+
+
+class OrderPagination(KeysetPagination):
+  """Newest orders first, seeking on (placed_at, id)."""
+  ordering = '-placed_at'
@@ -0,0 +1,28 @@
+from collections import defaultdict
+from django.db import transaction
+from . import outbox
+from .models import Order
+
+
+def set_payment_statuses(statuses):
+    """
+    Apply {order_id: payment_status} with one UPDATE per target status and
+    return {payment_status: [order ids moved to it]}. Orders that are
+    missing or may not make their transition are skipped. A single
+    payment_status_changed event describes the whole call.
+    """
+    targets = defaultdict(list)
+    for order_id, status in statuses.items():
+        targets[status].append(order_id)
+
+    changes = {}
+    with transaction.atomic():
+        for status, order_ids in sorted(targets.items()):
+            moved = Order.objects \
+                .filter(pk__in=order_ids) \
+                .transition_payment_status(status)
+            if moved:
+                changes[status] = moved
+        if changes:
+            outbox.publish('payment_status_changed', changes=changes)
+    return changes
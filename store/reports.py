@@ -0,0 +1,78 @@
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from .models import ArchivedOrderItem, CollectionSales, Order, OrderItem, ProductSales, ReportWatermark
+
+SALES_WATERMARK = 'sales'
+# Orders saved this long before a run may still be committing, so the
+# next run looks at them again. Refolding a day is idempotent.
+LAG = timedelta(minutes=5)
+
+
+def get_day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
+
+
+def fold_day(day):
+    """
+    Recompute the rollups of one day from its complete orders, archived
+    ones included.
+    """
+    start, end = get_day_bounds(day)
+    totals = {
+        'units': Sum('quantity'),
+        'revenue': Sum(F('quantity') * F('unit_price')),
+        'orders': Count('order_id', distinct=True),
+    }
+    products, collections = {}, {}
+    for item_model in [OrderItem, ArchivedOrderItem]:
+        items = item_model.objects \
+            .filter(order__placed_at__gte=start, order__placed_at__lt=end,
+                    order__payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+            .order_by()
+        # An order is in one table or the other, so the counts just add up
+        add_totals(products, 'product_id',
+                   items.values('product_id').annotate(**totals))
+        add_totals(collections, 'collection_id',
+                   items.values(collection_id=F('product__collection_id')).annotate(**totals))
+
+    with transaction.atomic():
+        ProductSales.objects.filter(date=day).delete()
+        ProductSales.objects.bulk_create([
+            ProductSales(date=day, **row) for row in products.values()
+        ])
+        CollectionSales.objects.filter(date=day).delete()
+        CollectionSales.objects.bulk_create([
+            CollectionSales(date=day, **row) for row in collections.values()
+        ])
+
+
+def add_totals(rollup, key, rows):
+    for row in rows:
+        total = rollup.setdefault(row[key], {key: row[key], 'units': 0, 'revenue': 0, 'orders': 0})
+        for field in ['units', 'revenue', 'orders']:
+            total[field] += row[field]
+
+
+def refresh_sales_rollups():
+    """
+    Refold the days of every order created or changed since the last run
+    and return how many days were refolded. The first run folds them all.
+    """
+    started = timezone.now()
+    watermark = ReportWatermark.objects \
+        .filter(name=SALES_WATERMARK) \
+        .values_list('value', flat=True) \
+        .first()
+    orders = Order.objects.all()
+    if watermark is not None:
+        orders = orders.filter(last_update__gte=watermark)
+    days = list(orders.order_by().dates('placed_at', 'day'))
+    for day in days:
+        fold_day(day)
+    ReportWatermark.objects.update_or_create(
+        name=SALES_WATERMARK, defaults={'value': started - LAG})
+    return len(days)
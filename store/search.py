@@ -0,0 +1,90 @@
+import operator
+import re
+from collections import Counter
+from functools import reduce
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Product, ProductSearchTerm
+
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+MAX_WEIGHT = 1000
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:MAX_TERM_LENGTH]
+            for token in TOKEN_RE.findall(text.lower())
+            if len(token) >= MIN_TERM_LENGTH]
+
+
+def get_term_weights(product):
+    weights = Counter()
+    for term in tokenize(product.title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(product.description):
+        weights[term] += DESCRIPTION_WEIGHT
+    return {term: min(weight, MAX_WEIGHT) for term, weight in weights.items()}
+
+
+def get_terms(product):
+    return [
+        ProductSearchTerm(product_id=product.id, term=term, weight=weight)
+        for term, weight in get_term_weights(product).items()
+    ]
+
+
+def index_product(product):
+    with transaction.atomic():
+        ProductSearchTerm.objects.filter(product_id=product.id).delete()
+        ProductSearchTerm.objects.bulk_create(get_terms(product))
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Re-index the whole catalog, e.g. after raw SQL imports or bulk updates
+    that bypass the Product signals. Runs in one transaction, so searches
+    keep seeing the old index until the new one is complete.
+    """
+    count = 0
+    with transaction.atomic():
+        ProductSearchTerm.objects.all().delete()
+        products = Product.objects.only('id', 'title', 'description')
+        for product in products.iterator(chunk_size=batch_size):
+            ProductSearchTerm.objects.bulk_create(
+                get_terms(product), batch_size=batch_size)
+            count += 1
+    return count
+
+
+def search_products(queryset, query):
+    """
+    Restrict `queryset` to products matching every word of `query` (by
+    prefix) and annotate it with `search_rank`, the summed term weights.
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return queryset.none().annotate(
+            search_rank=Value(0, output_field=IntegerField()))
+
+    ranks = []
+    for token in tokens:
+        # Terms and tokens are both lowercase; a case-insensitive match
+        # would keep MySQL from using the term index under some collations.
+        matches = ProductSearchTerm.objects.filter(term__startswith=token)
+        queryset = queryset.filter(pk__in=matches.values('product_id'))
+        weight = matches \
+            .filter(product_id=OuterRef('pk')) \
+            .values('product_id') \
+            .annotate(total=Sum('weight')) \
+            .values('total')
+        ranks.append(
+            Coalesce(Subquery(weight), 0, output_field=IntegerField()))
+
+    return queryset.annotate(search_rank=reduce(operator.add, ranks))
@@ -1,8 +1,13 @@
-from decimal import Decimal
+from collections import defaultdict
+from uuid import UUID
 from django.db import transaction
 from rest_framework import serializers
-from .signals import order_created
-from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, ProductImage, Review
+from rest_framework.exceptions import NotFound
+from . import outbox
+from .carts import get_cart_store, materialize, parse_cart_id
+from .payments import set_payment_statuses
+from .taxes import get_price_with_tax
+from .models import ArchivedOrder, ArchivedOrderItem, Cart, CartItem, Customer, CustomerHistory, InsufficientInventory, Order, OrderItem, Product, Collection, ProductImage, Review
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -35,8 +40,95 @@ class ProductSerializer(serializers.ModelSerializer):
     price_with_tax = serializers.SerializerMethodField(
         method_name='calculate_tax')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldsets: the view passes the fields the client asked for
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        # Querysets from the views annotate this in SQL; instances that were
+        # just created or updated are priced from the same cached rates.
+        if hasattr(product, 'price_with_tax'):
+            return product.price_with_tax
+        return get_price_with_tax(product)
+
+
+class ProductRowListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        rows = list(data)
+        self.child.images = defaultdict(list)
+        fields = self.context.get('fields')
+        if fields is None or 'images' in fields:
+            images = ProductImage.objects \
+                .filter(product_id__in=[row['id'] for row in rows]) \
+                .order_by('id') \
+                .values_list('product_id', 'id', 'image')
+            for product_id, image_id, image in images:
+                self.child.images[product_id].append(
+                    {'id': image_id, 'image': self.child.get_image_url(image)})
+        return [self.child.to_representation(row) for row in rows]
+
+
+class ProductRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only twin of ProductSerializer for list responses. It takes
+    values() rows annotated with price_with_tax, loads all their images in
+    one query and renders exactly what ProductSerializer would.
+    """
+    unit_price = serializers.DecimalField(max_digits=6, decimal_places=2)
+    images = {}
+
+    class Meta:
+        list_serializer_class = ProductRowListSerializer
+
+    def get_image_url(self, name):
+        if not name:
+            return None
+        url = ProductImage._meta.get_field('image').storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def to_representation(self, row):
+        data = {
+            'id': row['id'],
+            'title': row['title'],
+            'description': row.get('description'),
+            'slug': row['slug'],
+            'inventory': row['inventory'],
+            'unit_price': self.unit_price.to_representation(row['unit_price']),
+            'price_with_tax': row['price_with_tax'],
+            'collection': row['collection_id'],
+            'images': self.images.get(row['id'], []),
+        }
+        fields = self.context.get('fields')
+        if fields is not None:
+            return {name: data[name] for name in fields}
+        return data
+
+
+class ProductBatchSerializer(serializers.Serializer):
+    MAX_IDS = 100
+
+    ids = serializers.CharField()
+
+    def validate_ids(self, value):
+        try:
+            ids = [int(id) for id in value.split(',') if id.strip()]
+        except ValueError:
+            raise serializers.ValidationError(
+                'Expected a comma-separated list of product IDs.')
+        if not ids:
+            raise serializers.ValidationError('No product IDs were given.')
+        if len(ids) > self.MAX_IDS:
+            raise serializers.ValidationError(
+                f'No more than {self.MAX_IDS} products can be fetched at once.')
+        # Drop duplicates but keep the requested order
+        return list(dict.fromkeys(ids))
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -67,15 +159,31 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'total_price']
 
 
+class CartIdField(serializers.UUIDField):
+    """A cart UUID, also accepting the signed token of a lazy cart."""
+
+    def to_internal_value(self, data):
+        try:
+            return parse_cart_id(data)[0]
+        except ValueError:
+            self.fail('invalid', value=data)
+
+
 class CartSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
 
+    def to_representation(self, cart):
+        data = super().to_representation(cart)
+        # Clients of lazy carts keep addressing them by their token
+        if getattr(cart, 'token', None):
+            data['id'] = cart.token
+        return data
+
     def get_total_price(self, cart):
-        # Use prefetched items if available to avoid extra queries
-        items = cart.items.all()
-        return sum([item.quantity * item.product.unit_price for item in items])
+        # Stored on the cart and kept current by every cart item write
+        return cart.subtotal
 
     class Meta:
         model = Cart
@@ -85,34 +193,141 @@ class CartSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'No product with the given ID was found.')
-        return value
-
     def save(self, **kwargs):
-        cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
-
         try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
-
+            cart_id = UUID(str(self.context['cart_id']))
+        except ValueError:
+            raise NotFound('No cart with the given ID was found.')
+
+        cart_store = get_cart_store()
+        if cart_store is not None:
+            # Redis has no foreign keys to check the product for us
+            if not Product.objects.filter(pk=product_id).exists():
+                self.raise_no_product()
+            self.instance = cart_store.add_item(cart_id, product_id, quantity)
+        else:
+            if self.context.get('cart_token'):
+                materialize(cart_id)
+            self.instance = CartItem.objects.add_quantity(
+                cart_id, product_id, quantity)
+
+        if self.instance is None:
+            # Only the failure path pays for finding out what was missing
+            if not Product.objects.filter(pk=product_id).exists():
+                self.raise_no_product()
+            raise NotFound('No cart with the given ID was found.')
         return self.instance
 
+    def raise_no_product(self):
+        raise serializers.ValidationError(
+            {'product_id': ['No product with the given ID was found.']})
+
     class Meta:
         model = CartItem
         fields = ['id', 'product_id', 'quantity']
 
 
+class CartSummarySerializer(serializers.ModelSerializer):
+    total_price = serializers.DecimalField(
+        source='subtotal', max_digits=9, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = Cart
+        fields = ['id', 'items_count', 'total_price']
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if data['op'] == 'add' and not data.get('quantity'):
+            raise serializers.ValidationError(
+                {'quantity': 'Adding needs a quantity of at least 1.'})
+        if data['op'] == 'set' and 'quantity' not in data:
+            raise serializers.ValidationError(
+                {'quantity': 'Setting needs a quantity; 0 removes the item.'})
+        return data
+
+
+class BulkCartItemSerializer(serializers.Serializer):
+    """
+    Applies add / set / remove operations, in order, to a whole cart in one
+    transaction and returns the resulting cart.
+    """
+    MAX_OPERATIONS = 100
+
+    operations = CartOperationSerializer(
+        many=True, allow_empty=False, max_length=MAX_OPERATIONS)
+
+    def validate_operations(self, operations):
+        product_ids = {operation['product_id'] for operation in operations
+                       if operation['op'] != 'remove'}
+        found = Product.objects \
+            .filter(pk__in=product_ids) \
+            .values_list('id', flat=True)
+        missing = sorted(product_ids - set(found))
+        if missing:
+            raise serializers.ValidationError(
+                f'No products with the IDs {missing} were found.')
+        return operations
+
+    def save(self, **kwargs):
+        operations = self.validated_data['operations']
+        try:
+            cart_id = UUID(str(self.context['cart_id']))
+        except ValueError:
+            raise NotFound('No cart with the given ID was found.')
+
+        cart_store = get_cart_store()
+        if cart_store is not None:
+            if not cart_store.apply_operations(cart_id, operations):
+                raise NotFound('No cart with the given ID was found.')
+            return cart_store.get(cart_id)
+
+        if self.context.get('cart_token'):
+            materialize(cart_id)
+        with transaction.atomic():
+            # Locking the cart serializes bulk writes to the same cart
+            if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                raise NotFound('No cart with the given ID was found.')
+            items = {item.product_id: item
+                     for item in CartItem.objects.filter(cart_id=cart_id)}
+
+            quantities = {product_id: item.quantity
+                          for product_id, item in items.items()}
+            for operation in operations:
+                product_id = operation['product_id']
+                if operation['op'] == 'add':
+                    quantities[product_id] = \
+                        quantities.get(product_id, 0) + operation['quantity']
+                elif operation['op'] == 'set' and operation['quantity'] > 0:
+                    quantities[product_id] = operation['quantity']
+                else:
+                    quantities.pop(product_id, None)
+
+            removed = [item.id for product_id, item in items.items()
+                       if product_id not in quantities]
+            changed = []
+            for product_id, item in items.items():
+                if quantities.get(product_id, item.quantity) != item.quantity:
+                    item.quantity = quantities[product_id]
+                    changed.append(item)
+            added = [CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                     for product_id, quantity in quantities.items()
+                     if product_id not in items]
+
+            CartItem.objects.filter(pk__in=removed).delete()
+            CartItem.objects.bulk_update(changed, ['quantity'])
+            CartItem.objects.bulk_create(added)
+            Cart.objects.filter(pk=cart_id).refresh_totals()
+
+        return Cart.objects.prefetch_related('items__product').get(pk=cart_id)
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
@@ -127,6 +342,13 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ['id', 'user_id', 'phone', 'birth_date', 'membership']
 
 
+class CustomerHistorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerHistory
+        fields = ['customer_id', 'orders_count', 'total_spent',
+                  'last_order_at', 'top_products']
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
 
@@ -143,20 +365,73 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'customer', 'placed_at', 'payment_status', 'items']
 
 
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+    class Meta(OrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+
+class ArchivedOrderSerializer(OrderSerializer):
+    items = ArchivedOrderItemSerializer(many=True)
+
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
+
 class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['payment_status']
 
 
+class OrderPaymentStatusSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    payment_status = serializers.ChoiceField(choices=Order.PAYMENT_STATUS_CHOICES)
+
+
+class BulkUpdateOrderSerializer(serializers.Serializer):
+    """
+    Moves many orders to new payment statuses and returns the ids moved to
+    each; orders whose transition isn't allowed are left as they are.
+    """
+    MAX_ORDERS = 10000
+
+    orders = OrderPaymentStatusSerializer(
+        many=True, allow_empty=False, max_length=MAX_ORDERS)
+
+    def validate_orders(self, orders):
+        order_ids = [order['id'] for order in orders]
+        if len(set(order_ids)) != len(order_ids):
+            raise serializers.ValidationError('Each order may appear only once.')
+        return orders
+
+    def save(self, **kwargs):
+        return set_payment_statuses({
+            order['id']: order['payment_status']
+            for order in self.validated_data['orders']
+        })
+
+
 class CreateOrderSerializer(serializers.Serializer):
-    cart_id = serializers.UUIDField()
+    cart_id = CartIdField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        cart_store = get_cart_store()
+        if cart_store is not None:
+            if not cart_store.exists(cart_id):
+                raise serializers.ValidationError(
+                    'No cart with the given ID was found.')
+            if cart_store.count_items(cart_id) == 0:
+                raise serializers.ValidationError('The cart is empty.')
+            return cart_id
+
+        items_count = Cart.objects \
+            .filter(pk=cart_id) \
+            .values_list('items_count', flat=True) \
+            .first()
+        if items_count is None:
             raise serializers.ValidationError(
                 'No cart with the given ID was found.')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if items_count == 0:
             raise serializers.ValidationError('The cart is empty.')
         return cart_id
 
@@ -164,13 +439,33 @@ class CreateOrderSerializer(serializers.Serializer):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
 
+            cart_store = get_cart_store()
+            if cart_store is not None:
+                # Checkout reads the rows, so write the cart behind first
+                cart_store.flush(cart_id)
+                transaction.on_commit(lambda: cart_store.delete(cart_id))
+
             customer = Customer.objects.get(
                 user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
 
             cart_items = CartItem.objects \
                 .select_related('product') \
                 .filter(cart_id=cart_id)
+            cart_items = list(cart_items)
+            try:
+                Product.objects.reserve(
+                    {item.product_id: item.quantity for item in cart_items})
+            except InsufficientInventory as error:
+                titles = [item.product.title for item in cart_items
+                          if item.product_id in error.product_ids]
+                if not titles:
+                    # Restocked between the failed UPDATE and the re-read
+                    raise serializers.ValidationError(
+                        {'cart_id': ['Stock changed during checkout, please try again.']})
+                raise serializers.ValidationError(
+                    {'cart_id': [f'Not enough stock for: {", ".join(titles)}.']})
+
+            order = Order.objects.create(customer=customer)
             order_items = [
                 OrderItem(
                     order=order,
@@ -180,9 +475,41 @@ class CreateOrderSerializer(serializers.Serializer):
                 ) for item in cart_items
             ]
             OrderItem.objects.bulk_create(order_items)
+            CustomerHistory.objects.record_order(order, order_items)
 
             Cart.objects.filter(pk=cart_id).delete()
 
-            order_created.send_robust(self.__class__, order=order)
+            # Receivers run later, from the outbox dispatcher
+            outbox.publish('order_created', order_id=order.id)
 
             return order
+
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    # 'day' returns a row per day, 'range' one row over the whole range
+    group_by = serializers.ChoiceField(['day', 'range'], default='day')
+    # Only these products/collections, e.g. ?id=1&id=2
+    id = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError(
+                {'end': 'The end date must not be before the start date.'})
+        return data
+
+
+class SalesSerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+    orders = serializers.IntegerField()
+
+
+class ProductSalesSerializer(SalesSerializer):
+    product_id = serializers.IntegerField()
+
+
+class CollectionSalesSerializer(SalesSerializer):
+    collection_id = serializers.IntegerField()
@@ -1,9 +1,120 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from store.models import Customer
+from django.utils import timezone
+from store.caching import invalidate
+from store.models import Cart, CartItem, Collection, Customer, CustomerHistory, Order, Product, ProductImage, Review, TaxRate
+from store.search import index_product
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
   if kwargs['created']:
-    Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+    Customer.objects.create(user=kwargs['instance'])
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+  # Terms are removed by the FK cascade when a product is deleted.
+  if update_fields and not {'title', 'description'} & set(update_fields):
+    return
+  index_product(instance)
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_values(sender, instance, raw=False, update_fields=None, **kwargs):
+  if raw or instance._state.adding:
+    return
+  if update_fields is not None and not {'collection', 'unit_price'} & set(update_fields):
+    return
+  previous = Product.objects \
+    .filter(pk=instance.pk) \
+    .values_list('collection_id', 'unit_price') \
+    .first()
+  if previous is not None:
+    instance._previous_collection_id, instance._previous_unit_price = previous
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, raw=False, **kwargs):
+  if raw:
+    return
+  if created:
+    Collection.objects.add_products_count({instance.collection_id: 1})
+    return
+  previous = getattr(instance, '_previous_collection_id', None)
+  if previous is not None and previous != instance.collection_id:
+    Collection.objects.add_products_count(
+      {previous: -1, instance.collection_id: 1})
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+  Collection.objects.add_products_count({instance.collection_id: -1})
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, created, raw=False, **kwargs):
+  previous = getattr(instance, '_previous_unit_price', None)
+  if raw or created or previous is None or previous == instance.unit_price:
+    return
+  carts = CartItem.objects.filter(product_id=instance.pk).values('cart_id')
+  Cart.objects.filter(pk__in=carts).refresh_totals(touch=False)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_carts(sender, instance, **kwargs):
+  # The cart lines go with the product, so find their carts beforehand.
+  instance._cart_ids = list(CartItem.objects
+    .filter(product_id=instance.pk)
+    .values_list('cart_id', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def refresh_carts_of_deleted_product(sender, instance, **kwargs):
+  if getattr(instance, '_cart_ids', None):
+    Cart.objects.filter(pk__in=instance._cart_ids).refresh_totals(touch=False)
+
+
+@receiver(post_save, sender=CartItem)
+def refresh_cart_totals(sender, instance, raw=False, **kwargs):
+  # Bulk and raw-SQL cart writes maintain the totals themselves. There's
+  # deliberately no post_delete twin: see CartQuerySet.refresh_totals.
+  if not raw:
+    Cart.objects.filter(pk=instance.cart_id).refresh_totals()
+
+
+@receiver(pre_save, sender=Order)
+def remember_previous_payment_status(sender, instance, raw=False, update_fields=None, **kwargs):
+  if raw or instance._state.adding:
+    return
+  if update_fields is not None and 'payment_status' not in update_fields:
+    return
+  instance._previous_payment_status = Order.objects \
+    .filter(pk=instance.pk) \
+    .values_list('payment_status', flat=True) \
+    .first()
+
+
+@receiver(post_save, sender=Order)
+def update_customer_history(sender, instance, created, raw=False, **kwargs):
+  # New orders are recorded by checkout, together with their items.
+  previous = getattr(instance, '_previous_payment_status', None)
+  if raw or created or previous is None or previous == instance.payment_status:
+    return
+  CustomerHistory.objects.record_payment_status(
+    [instance.pk], previous, instance.payment_status)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product(sender, instance, **kwargs):
+  # Images are part of the product representation, so they bump last_update.
+  Product.objects.filter(pk=instance.product_id).update(last_update=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Collection)
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=TaxRate)
+def invalidate_cached_responses(sender, **kwargs):
+  invalidate(sender)
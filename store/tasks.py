@@ -0,0 +1,31 @@
+import logging
+from celery import shared_task
+from . import archive, carts, outbox, reports
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def purge_abandoned_carts(age=None, batch_size=1000):
+    purged = carts.purge_abandoned_carts(age, batch_size)
+    logger.info('Purged %d abandoned carts', purged)
+    return purged
+
+
+@shared_task
+def dispatch_outbox(batch_size=100):
+    return outbox.dispatch(batch_size)
+
+
+@shared_task
+def refresh_sales_rollups():
+    days = reports.refresh_sales_rollups()
+    logger.info('Refolded sales rollups for %d days', days)
+    return days
+
+
+@shared_task
+def archive_orders(age=None, batch_size=500):
+    archived = archive.archive_orders(age, batch_size)
+    logger.info('Archived %d orders', archived)
+    return archived
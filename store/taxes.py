@@ -0,0 +1,65 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Round
+from .caching import get_generation
+from .models import TaxRate
+
+CENT = Decimal('0.01')
+
+# Per-process copy of the TaxRate table, reloaded when its generation moves.
+_rates = {'generation': None, 'rates': {}}
+
+
+def get_rates():
+    generation = get_generation(TaxRate)
+    if _rates['generation'] != generation:
+        _rates['rates'] = {
+            (region, collection_id): rate
+            for region, collection_id, rate
+            in TaxRate.objects.values_list('region', 'collection_id', 'rate')
+        }
+        _rates['generation'] = generation
+    return _rates['rates']
+
+
+def get_collection_rates(region=None):
+    """
+    Return the default rate and a {collection_id: rate} map for `region`.
+    Region rows take precedence over the catch-all rows with a blank region.
+    """
+    if region is None:
+        region = settings.TAX_REGION
+    rates = get_rates()
+
+    default = rates.get(('', None), Decimal(settings.DEFAULT_TAX_RATE))
+    by_collection = {collection_id: rate
+                     for (rate_region, collection_id), rate in rates.items()
+                     if rate_region == '' and collection_id is not None}
+    if region:
+        if (region, None) in rates:
+            default = rates[(region, None)]
+            by_collection = {}
+        by_collection.update({collection_id: rate
+                              for (rate_region, collection_id), rate in rates.items()
+                              if rate_region == region and collection_id is not None})
+    return default, by_collection
+
+
+def annotate_price_with_tax(queryset, region=None):
+    default, by_collection = get_collection_rates(region)
+    multiplier = Case(
+        *[When(collection_id=collection_id, then=Value(1 + rate))
+          for collection_id, rate in by_collection.items()],
+        default=Value(1 + default),
+        # 1 + rate, and rate goes up to 9.9999
+        output_field=DecimalField(max_digits=6, decimal_places=4))
+    return queryset.annotate(price_with_tax=Round(
+        F('unit_price') * multiplier, 2,
+        output_field=DecimalField(max_digits=9, decimal_places=2)))
+
+
+def get_price_with_tax(product, region=None):
+    default, by_collection = get_collection_rates(region)
+    rate = by_collection.get(product.collection_id, default)
+    return (product.unit_price * (1 + rate)).quantize(CENT)
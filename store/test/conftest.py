@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from rest_framework.test import APIClient
 import pytest
 from core.models import User
@@ -13,3 +14,8 @@ def authenticate(api_client):
     def do_authenticate(is_staff=False):
         return api_client.force_authenticate(user=User(is_staff=is_staff))
     return do_authenticate
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
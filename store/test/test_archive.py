@@ -0,0 +1,126 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from django.core.management import call_command
+from django.utils import timezone
+from core.models import User
+from store import reports
+from store.archive import archive_orders
+from store.models import (ArchivedOrder, ArchivedOrderItem, Customer, CustomerHistory,
+                          Order, OrderItem, Product, ProductSales)
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+def make_order(days_ago, payment_status=Order.PAYMENT_STATUS_COMPLETE, **kwargs):
+    order = baker.make(Order, payment_status=payment_status, **kwargs)
+    Order.objects.filter(pk=order.pk).update(
+        placed_at=timezone.now() - timedelta(days=days_ago))
+    baker.make(OrderItem, order=order, product=baker.make(Product), quantity=2, unit_price=5)
+    return order
+
+
+@pytest.mark.django_db
+class TestArchiveOrders:
+
+    def test_moves_only_old_complete_orders_in_batches(self):
+        old = [make_order(400) for _ in range(3)]
+        pending = make_order(400, payment_status=Order.PAYMENT_STATUS_PENDING)
+        recent = make_order(10)
+
+        archived = archive_orders(age=365 * 24 * 60 * 60, batch_size=2)
+
+        assert archived == 3
+        assert sorted(ArchivedOrder.objects.values_list('id', flat=True)) == [order.id for order in old]
+        assert ArchivedOrderItem.objects.count() == 3
+        assert sorted(Order.objects.values_list('id', flat=True)) == [pending.id, recent.id]
+        assert OrderItem.objects.count() == 2
+
+    def test_archived_orders_still_count_in_rollups_and_history(self):
+        customer = baker.make(Customer)
+        order = make_order(400, customer=customer)
+        day = timezone.localdate(Order.objects.get(pk=order.pk).placed_at)
+        archive_orders(age=365 * 24 * 60 * 60)
+
+        reports.fold_day(day)
+        call_command('backfill_customer_history')
+
+        sales = ProductSales.objects.get(date=day)
+        assert (sales.units, sales.revenue, sales.orders) == (2, 10, 1)
+        history = CustomerHistory.objects.get(pk=customer.pk)
+        assert (history.orders_count, history.total_spent) == (1, 10)
+
+
+@pytest.mark.django_db
+class TestRetrieveArchivedOrder:
+
+    def test_staff_and_owner_can_retrieve_archived_order(self, api_client):
+        customer = baker.make(Customer)
+        order = make_order(400, customer=customer)
+        archive_orders(age=365 * 24 * 60 * 60)
+
+        api_client.force_authenticate(user=customer.user)
+        own = api_client.get(f'/store/api/orders/{order.id}/')
+        api_client.force_authenticate(user=User(is_staff=True))
+        staff = api_client.get(f'/store/api/orders/{order.id}/')
+
+        assert own.status_code == staff.status_code == status.HTTP_200_OK
+        assert own.data['id'] == order.id
+        assert own.data['items'][0]['quantity'] == 2
+
+    def test_other_customer_gets_404(self, api_client):
+        order = make_order(400)
+        archive_orders(age=365 * 24 * 60 * 60)
+        api_client.force_authenticate(user=baker.make(Customer).user)
+
+        response = api_client.get(f'/store/api/orders/{order.id}/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestReadArchivedOrders:
+
+    def test_customer_list_merges_archived_orders_in_pages(self, api_client):
+        customer = baker.make(Customer)
+        archived = make_order(400, customer=customer)
+        live = [make_order(days, customer=customer) for days in [1, 500]]
+        archive_orders(age=365 * 24 * 60 * 60)
+        api_client.force_authenticate(user=customer.user)
+
+        first = api_client.get('/store/api/orders/', {'limit': 2})
+        second = api_client.get(first.data['next'])
+
+        ids = [order['id'] for order in first.data['results'] + second.data['results']]
+        assert ids == [live[0].id, archived.id, live[1].id]
+        assert first.data['results'][1]['items'][0]['quantity'] == 2
+        assert second.data['next'] is None
+
+    def test_order_detail_page_shows_archived_order(self, client):
+        customer = baker.make(Customer)
+        order = make_order(400, customer=customer)
+        archive_orders(age=365 * 24 * 60 * 60)
+        client.force_login(customer.user)
+
+        response = client.get(f'/store/orders/{order.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.context['order'].pk == order.id
+
+    def test_exports_include_archived_orders(self, api_client, tmp_path):
+        archived = make_order(400)
+        live = make_order(1)
+        archive_orders(age=365 * 24 * 60 * 60)
+        api_client.force_authenticate(user=User(is_staff=True))
+        path = tmp_path / 'orders.ndjson'
+
+        response = api_client.get('/store/api/orders/export/', {'payment_status': 'C'})
+        call_command('export_orders', format='ndjson', batch_size=1, output=str(path))
+
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        assert [int(row['order_id']) for row in rows] == [archived.id, live.id]
+        assert rows[0]['quantity'] == '2'
+        orders = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [order['id'] for order in orders] == [archived.id, live.id]
@@ -0,0 +1,158 @@
+import time
+from django.core.cache import cache
+from store.caching import BUMPED_KEY, get_generation_key
+from store.models import Product, Collection, Review, TaxRate
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def product():
+    collection = baker.make(Collection)
+    return baker.make(Product, collection=collection, title='Coffee Mug')
+
+
+@pytest.mark.django_db
+class TestCachedResponses:
+
+    def test_repeated_anonymous_read_skips_database(self, api_client, product, django_assert_num_queries):
+        api_client.get(f'/store/api/products/{product.id}/')
+
+        with django_assert_num_queries(0):
+            response = api_client.get(f'/store/api/products/{product.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['title'] == 'Coffee Mug'
+
+    def test_query_params_are_normalized(self, api_client, product, django_assert_num_queries):
+        api_client.get('/store/api/products/?limit=5&ordering=unit_price')
+
+        with django_assert_num_queries(0):
+            api_client.get('/store/api/products/?ordering=unit_price&limit=5')
+
+    def test_saving_product_invalidates_responses(self, api_client, product, django_capture_on_commit_callbacks):
+        api_client.get('/store/api/products/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.title = 'Tea Cup'
+            product.save()
+
+        products = api_client.get('/store/api/products/')
+        assert products.data['results'][0]['title'] == 'Tea Cup'
+
+    def test_adding_review_invalidates_reviews(self, api_client, product, django_capture_on_commit_callbacks):
+        url = f'/store/api/products/{product.id}/reviews/'
+        api_client.get(url)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Review, product=product)
+
+        assert len(api_client.get(url).data) == 1
+
+    def test_evicted_generation_does_not_revive_old_entries(self, api_client, product, django_capture_on_commit_callbacks):
+        url = f'/store/api/collections/{product.collection_id}/'
+        api_client.get(url)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.collection.title = 'Kitchen'
+            product.collection.save()
+        cache.delete(get_generation_key(Collection))
+
+        assert api_client.get(url).data['title'] == 'Kitchen'
+
+    def test_authenticated_reads_bypass_cache(self, api_client, authenticate, product):
+        authenticate(is_staff=True)
+        api_client.get(f'/store/api/products/{product.id}/')
+
+        Product.objects.filter(pk=product.pk).update(title='Tea Cup')
+        response = api_client.get(f'/store/api/products/{product.id}/')
+
+        assert response.data['title'] == 'Tea Cup'
+
+
+@pytest.mark.django_db
+class TestConditionalGet:
+
+    def test_product_detail_has_validators(self, api_client, product):
+        response = api_client.get(f'/store/api/products/{product.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'].startswith('"')
+        assert 'Last-Modified' in response
+
+    def test_matching_etag_returns_304_without_serializing(self, api_client, product, django_assert_num_queries):
+        url = f'/store/api/products/{product.id}/'
+        etag = api_client.get(url)['ETag']
+
+        with django_assert_num_queries(0):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+
+    @pytest.mark.parametrize('header', ['HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE'])
+    def test_preconditions_on_missing_product_return_404(self, api_client, product, header):
+        value = '*' if header == 'HTTP_IF_NONE_MATCH' \
+            else api_client.get(f'/store/api/products/{product.id}/')['Last-Modified']
+
+        response = api_client.get('/store/api/products/999999/', **{header: value})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_matching_last_modified_returns_304(self, api_client, product):
+        url = '/store/api/products/'
+        last_modified = api_client.get(url)['Last-Modified']
+
+        response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_changed_product_returns_200(self, api_client, product, django_capture_on_commit_callbacks):
+        url = '/store/api/products/'
+        etag = api_client.get(url)['ETag']
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Product, collection=product.collection)
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_collection_etag_changes_with_products(self, api_client, product, django_capture_on_commit_callbacks):
+        url = '/store/api/collections/'
+        etag = api_client.get(url)['ETag']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Product, collection=product.collection)
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_deleted_product_changes_etag(self, api_client, product, django_capture_on_commit_callbacks):
+        url = '/store/api/products/'
+        baker.make(Product, collection=product.collection)
+        etag = api_client.get(url)['ETag']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.delete()
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.parametrize('change', ['delete_product', 'add_tax_rate'])
+    def test_last_modified_moves_on_deletes_and_tax_rates(
+            self, api_client, product, change, django_capture_on_commit_callbacks):
+        for label in ['store.product', 'store.productimage', 'store.taxrate']:
+            cache.set(BUMPED_KEY.format(label), time.time() - 60, timeout=None)
+        url = '/store/api/products/'
+        last_modified = api_client.get(url)['Last-Modified']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            if change == 'delete_product':
+                product.delete()
+            else:
+                baker.make(TaxRate, collection=product.collection)
+
+        response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == status.HTTP_200_OK
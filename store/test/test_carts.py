@@ -1,3 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from django.utils import timezone
+from redis.exceptions import RedisError
+from rest_framework.test import APIClient
+from store.carts import CART_KEY, get_cart_store, parse_cart_id, purge_abandoned_carts
 from store.models import Cart, CartItem, Product, Collection
 from rest_framework import status
 import pytest
@@ -106,3 +114,377 @@ class TestCartItems:
 
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data) == 2
+
+
+@pytest.mark.django_db
+class TestUpsertQuantity:
+    # Runs the backend's own statement: ON DUPLICATE KEY UPDATE on MySQL,
+    # the configured database, and ON CONFLICT elsewhere.
+
+    def test_inserts_then_increments_the_same_row(self):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart = baker.make(Cart)
+
+        first = CartItem.objects.upsert_quantity(cart.id, product.id, 2)
+        second = CartItem.objects.upsert_quantity(cart.id, product.id, 3)
+
+        assert second.id == first.id
+        assert (first.quantity, second.quantity) == (2, 5)
+        assert CartItem.objects.get(cart=cart, product=product).quantity == 5
+
+    def test_returns_none_for_unknown_product_or_cart(self):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart = baker.make(Cart)
+
+        assert CartItem.objects.upsert_quantity(cart.id, 999999, 1) is None
+        assert CartItem.objects.upsert_quantity(
+            '11111111-1111-1111-1111-111111111111', product.id, 1) is None
+        assert not CartItem.objects.exists()
+
+    def test_add_is_one_totals_update_and_one_upsert(self, django_assert_num_queries):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart = baker.make(Cart)
+
+        with django_assert_num_queries(2):
+            CartItem.objects.add_quantity(cart.id, product.id, 1)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentAddToCart:
+
+    def test_concurrent_adds_lose_no_updates(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            pytest.skip('Shared-cache in-memory SQLite fails on locks instead of waiting.')
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart = baker.make(Cart)
+
+        def add_to_cart(_):
+            try:
+                return APIClient().post(f'/store/api/carts/{cart.id}/items/',
+                                        {'product_id': product.id, 'quantity': 1})
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(add_to_cart, range(40)))
+
+        assert all(r.status_code == status.HTTP_201_CREATED for r in responses)
+        assert CartItem.objects.get(cart=cart, product=product).quantity == 40
+
+
+@pytest.fixture
+def redis_carts(settings):
+    settings.CART_ENGINE = 'redis'
+    try:
+        cart_store = get_cart_store()
+        cart_store.redis.ping()
+    except (NotImplementedError, RedisError):
+        pytest.skip('The Redis cart engine needs a django_redis cache.')
+    yield cart_store
+    for key in cart_store.redis.scan_iter(match=CART_KEY.format('*')):
+        cart_store.redis.delete(key)
+
+
+@pytest.mark.django_db
+class TestRedisCarts:
+
+    def test_cart_is_not_written_to_the_database(self, api_client, redis_carts):
+        product = baker.make(Product, collection=baker.make(Collection))
+
+        cart_id = api_client.post('/store/api/carts/', {}).data['id']
+        api_client.post(f'/store/api/carts/{cart_id}/items/',
+                        {'product_id': product.id, 'quantity': 2})
+        response = api_client.get(f'/store/api/carts/{cart_id}/')
+
+        assert not Cart.objects.exists()
+        assert response.data['items'][0]['quantity'] == 2
+        assert response.data['total_price'] == 2 * product.unit_price
+
+    def test_adding_twice_increments_quantity(self, api_client, redis_carts):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart_id = api_client.post('/store/api/carts/', {}).data['id']
+
+        for _ in range(2):
+            response = api_client.post(f'/store/api/carts/{cart_id}/items/',
+                                       {'product_id': product.id, 'quantity': 1})
+
+        assert response.data['quantity'] == 2
+
+    def test_update_and_delete_item(self, api_client, redis_carts):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart_id = api_client.post('/store/api/carts/', {}).data['id']
+        item_id = api_client.post(f'/store/api/carts/{cart_id}/items/',
+                                  {'product_id': product.id, 'quantity': 1}).data['id']
+
+        patched = api_client.patch(
+            f'/store/api/carts/{cart_id}/items/{item_id}/', {'quantity': 5})
+        deleted = api_client.delete(f'/store/api/carts/{cart_id}/items/{item_id}/')
+
+        assert patched.data['quantity'] == 5
+        assert deleted.status_code == status.HTTP_204_NO_CONTENT
+        assert api_client.get(f'/store/api/carts/{cart_id}/items/').data == []
+
+    def test_flush_writes_cart_rows(self, api_client, redis_carts):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart_id = api_client.post('/store/api/carts/', {}).data['id']
+        api_client.post(f'/store/api/carts/{cart_id}/items/',
+                        {'product_id': product.id, 'quantity': 3})
+
+        redis_carts.flush(cart_id)
+
+        item = CartItem.objects.get(cart_id=cart_id)
+        assert item.product_id == product.id
+        assert item.quantity == 3
+
+    def test_missing_cart_returns_404(self, api_client, redis_carts):
+        response = api_client.get(
+            '/store/api/carts/11111111-1111-1111-1111-111111111111/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_bulk_operations_on_expired_cart_do_not_recreate_it(self, api_client, redis_carts):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart_id = api_client.post('/store/api/carts/', {}).data['id']
+        redis_carts.delete(cart_id)
+
+        applied = redis_carts.apply_operations(
+            cart_id, [{'op': 'add', 'product_id': product.id, 'quantity': 1}])
+
+        assert not applied
+        assert not redis_carts.exists(cart_id)
+
+    def test_bulk_operations_apply_in_order(self, api_client, redis_carts):
+        first, second = baker.make(Product, collection=baker.make(Collection), _quantity=2)
+        cart_id = api_client.post('/store/api/carts/', {}).data['id']
+
+        redis_carts.apply_operations(cart_id, [
+            {'op': 'add', 'product_id': first.id, 'quantity': 2},
+            {'op': 'add', 'product_id': second.id, 'quantity': 1},
+            {'op': 'set', 'product_id': first.id, 'quantity': 5},
+            {'op': 'remove', 'product_id': second.id},
+        ])
+
+        assert redis_carts.get_quantities(cart_id)[0] == {first.id: 5}
+
+
+@pytest.mark.django_db
+class TestBulkCartItems:
+
+    def test_applies_operations_and_returns_cart(self, api_client):
+        collection = baker.make(Collection)
+        kept, removed, added = baker.make(Product, collection=collection, _quantity=3)
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=kept, quantity=1)
+        baker.make(CartItem, cart=cart, product=removed, quantity=1)
+
+        response = api_client.post(f'/store/api/carts/{cart.id}/items/bulk/', {
+            'operations': [
+                {'op': 'add', 'product_id': kept.id, 'quantity': 2},
+                {'op': 'remove', 'product_id': removed.id},
+                {'op': 'add', 'product_id': added.id, 'quantity': 1},
+                {'op': 'set', 'product_id': added.id, 'quantity': 4},
+            ]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['id'] == str(cart.id)
+        quantities = {item['product']['id']: item['quantity']
+                      for item in response.data['items']}
+        assert quantities == {kept.id: 3, added.id: 4}
+
+    def test_set_to_zero_removes_item(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=2)
+
+        api_client.post(f'/store/api/carts/{cart.id}/items/bulk/', {
+            'operations': [{'op': 'set', 'product_id': product.id, 'quantity': 0}]
+        }, format='json')
+
+        assert not CartItem.objects.filter(cart=cart).exists()
+
+    def test_unknown_product_returns_400_and_changes_nothing(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart = baker.make(Cart)
+
+        response = api_client.post(f'/store/api/carts/{cart.id}/items/bulk/', {
+            'operations': [
+                {'op': 'add', 'product_id': product.id, 'quantity': 1},
+                {'op': 'add', 'product_id': 999999, 'quantity': 1},
+            ]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not CartItem.objects.filter(cart=cart).exists()
+
+    def test_missing_cart_returns_404(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection))
+
+        response = api_client.post(
+            '/store/api/carts/11111111-1111-1111-1111-111111111111/items/bulk/',
+            {'operations': [{'op': 'add', 'product_id': product.id, 'quantity': 1}]},
+            format='json')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestCartTotals:
+
+    def test_add_update_and_delete_maintain_totals(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection),
+                             unit_price=Decimal('2.50'))
+        cart = baker.make(Cart)
+
+        item_id = api_client.post(f'/store/api/carts/{cart.id}/items/',
+                                  {'product_id': product.id, 'quantity': 2}).data['id']
+        cart.refresh_from_db()
+        assert (cart.items_count, cart.subtotal) == (2, Decimal('5.00'))
+
+        api_client.patch(f'/store/api/carts/{cart.id}/items/{item_id}/', {'quantity': 4})
+        cart.refresh_from_db()
+        assert (cart.items_count, cart.subtotal) == (4, Decimal('10.00'))
+
+        api_client.delete(f'/store/api/carts/{cart.id}/items/{item_id}/')
+        cart.refresh_from_db()
+        assert (cart.items_count, cart.subtotal) == (0, Decimal('0.00'))
+
+    def test_deleting_lines_directly_needs_refresh_totals(self):
+        product = baker.make(Product, collection=baker.make(Collection),
+                             unit_price=Decimal('2.00'))
+        cart = baker.make(Cart)
+        item = baker.make(CartItem, cart=cart, product=product, quantity=3)
+
+        item.delete()
+        Cart.objects.filter(pk=cart.pk).refresh_totals()
+
+        cart.refresh_from_db()
+        assert (cart.items_count, cart.subtotal) == (0, Decimal('0.00'))
+
+    def test_bulk_operations_maintain_totals(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection),
+                             unit_price=Decimal('3.00'))
+        cart = baker.make(Cart)
+
+        api_client.post(f'/store/api/carts/{cart.id}/items/bulk/', {
+            'operations': [{'op': 'add', 'product_id': product.id, 'quantity': 3}]
+        }, format='json')
+
+        cart.refresh_from_db()
+        assert (cart.items_count, cart.subtotal) == (3, Decimal('9.00'))
+
+    def test_price_change_reprices_carts(self):
+        product = baker.make(Product, collection=baker.make(Collection),
+                             unit_price=Decimal('2.00'))
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=3)
+
+        product.unit_price = Decimal('5.00')
+        product.save()
+        cart.refresh_from_db()
+        assert cart.subtotal == Decimal('15.00')
+
+        Product.objects.filter(pk=product.pk).update(unit_price=Decimal('1.00'))
+        cart.refresh_from_db()
+        assert cart.subtotal == Decimal('3.00')
+
+    def test_cart_read_does_not_sum_items(self, api_client, django_assert_num_queries):
+        product = baker.make(Product, collection=baker.make(Collection),
+                             unit_price=Decimal('4.00'))
+        cart = baker.make(Cart)
+        baker.make(CartItem, cart=cart, product=product, quantity=2)
+
+        with django_assert_num_queries(1):
+            response = api_client.get(f'/store/api/carts/{cart.id}/summary/')
+
+        assert response.data['items_count'] == 2
+        assert response.data['total_price'] == Decimal('8.00')
+
+
+@pytest.mark.django_db
+class TestPurgeAbandonedCarts:
+
+    def test_purges_only_idle_carts_in_batches(self):
+        product = baker.make(Product, collection=baker.make(Collection))
+        idle = baker.make(Cart, _quantity=3)
+        active = baker.make(Cart)
+        baker.make(CartItem, cart=idle[0], product=product, quantity=1)
+        Cart.objects.filter(pk__in=[cart.pk for cart in idle]) \
+            .update(last_activity=timezone.now() - timedelta(days=30))
+
+        purged = purge_abandoned_carts(age=24 * 60 * 60, batch_size=2)
+
+        assert purged == 3
+        assert list(Cart.objects.values_list('pk', flat=True)) == [active.pk]
+        assert not CartItem.objects.exists()
+
+    def test_adding_an_item_counts_as_activity(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection))
+        cart = baker.make(Cart)
+        Cart.objects.filter(pk=cart.pk) \
+            .update(last_activity=timezone.now() - timedelta(days=30))
+
+        api_client.post(f'/store/api/carts/{cart.id}/items/',
+                        {'product_id': product.id, 'quantity': 1})
+
+        assert purge_abandoned_carts(age=24 * 60 * 60) == 0
+
+
+@pytest.mark.django_db
+class TestLazyCarts:
+
+    @pytest.fixture(autouse=True)
+    def lazy_carts(self, settings):
+        settings.LAZY_CARTS = True
+
+    def test_create_returns_token_without_a_row(self, api_client):
+        response = api_client.post('/store/api/carts/', {})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert parse_cart_id(response.data['id'])[1] == response.data['id']
+        assert not Cart.objects.exists()
+
+    def test_reading_unmaterialized_cart_needs_no_query(
+            self, api_client, django_assert_num_queries):
+        token = api_client.post('/store/api/carts/', {}).data['id']
+
+        with django_assert_num_queries(0):
+            response = api_client.get(f'/store/api/carts/{token}/')
+            items = api_client.get(f'/store/api/carts/{token}/items/')
+
+        assert response.data == {'id': token, 'items': [], 'total_price': 0}
+        assert items.data == []
+
+    def test_first_item_materializes_the_cart(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection))
+        token = api_client.post('/store/api/carts/', {}).data['id']
+
+        api_client.post(f'/store/api/carts/{token}/items/',
+                        {'product_id': product.id, 'quantity': 2})
+        response = api_client.get(f'/store/api/carts/{token}/')
+
+        cart = Cart.objects.get()
+        assert cart.id == parse_cart_id(token)[0]
+        assert cart.items_count == 2
+        assert response.data['id'] == token
+        assert response.data['items'][0]['quantity'] == 2
+
+    def test_bulk_response_keeps_the_token(self, api_client):
+        product = baker.make(Product, collection=baker.make(Collection))
+        token = api_client.post('/store/api/carts/', {}).data['id']
+
+        response = api_client.post(f'/store/api/carts/{token}/items/bulk/', {
+            'operations': [{'op': 'add', 'product_id': product.id, 'quantity': 1}]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['id'] == token
+        assert response.data['items'][0]['quantity'] == 1
+
+    def test_tampered_token_returns_404(self, api_client):
+        token = api_client.post('/store/api/carts/', {}).data['id']
+
+        cart_id, _ = token.split(':')
+        response = api_client.get(f'/store/api/carts/{cart_id}:forged/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -1,4 +1,5 @@
-from store.models import Collection
+from django.core.management import call_command
+from store.models import Collection, Product
 from rest_framework import status
 import pytest
 from model_bakery import baker
@@ -56,3 +57,76 @@ class TestRetrieveCollection:
             'title': collection.title,
             'products_count': 0
         }
+
+
+@pytest.mark.django_db
+class TestProductsCount:
+
+    def count(self, collection):
+        collection.refresh_from_db()
+        return collection.products_count
+
+    def test_create_and_delete_product_adjust_count(self):
+        collection = baker.make(Collection)
+        products = baker.make(Product, collection=collection, _quantity=2)
+
+        products[0].delete()
+
+        assert self.count(collection) == 1
+
+    def test_moving_product_adjusts_both_collections(self):
+        source, target = baker.make(Collection, _quantity=2)
+        product = baker.make(Product, collection=source)
+
+        product.collection = target
+        product.save()
+
+        assert self.count(source) == 0
+        assert self.count(target) == 1
+
+    def test_bulk_create_adjusts_count(self):
+        collection = baker.make(Collection)
+
+        Product.objects.bulk_create(
+            baker.prepare(Product, collection=collection, _quantity=3))
+
+        assert self.count(collection) == 3
+
+    def test_queryset_update_adjusts_count(self):
+        source, target = baker.make(Collection, _quantity=2)
+        baker.make(Product, collection=source, _quantity=2)
+
+        Product.objects.filter(collection=source).update(collection=target)
+
+        assert self.count(source) == 0
+        assert self.count(target) == 2
+
+    def test_reconcile_command_fixes_drift(self):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+        Collection.objects.update(products_count=7)
+
+        call_command('reconcile_products_count')
+
+        assert self.count(collection) == 2
+
+    def test_reconcile_command_invalidates_cached_collections(
+            self, api_client, django_capture_on_commit_callbacks):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+        Collection.objects.update(products_count=7)
+        api_client.get(f'/store/api/collections/{collection.id}/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            call_command('reconcile_products_count')
+
+        response = api_client.get(f'/store/api/collections/{collection.id}/')
+        assert response.data['products_count'] == 2
+
+    def test_list_reads_stored_count(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+
+        response = api_client.get('/store/api/collections/')
+
+        assert response.data[0]['products_count'] == 2
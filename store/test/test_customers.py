@@ -1,4 +1,6 @@
-from store.models import Customer
+from decimal import Decimal
+from django.core.management import call_command
+from store.models import Cart, CartItem, Customer, CustomerHistory, Order, Product
 from core.models import User
 from rest_framework import status
 import pytest
@@ -64,3 +66,73 @@ class TestCustomerMe:
         response = api_client.get('/store/customers/me/')
 
         assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+class TestCustomerHistory:
+
+    def checkout(self, api_client, customer, quantities):
+        api_client.force_authenticate(user=customer.user)
+        cart = baker.make(Cart)
+        for product, quantity in quantities.items():
+            baker.make(CartItem, cart=cart, product=product, quantity=quantity)
+        return api_client.post('/store/api/orders/', {'cart_id': str(cart.id)})
+
+    def get_history(self, api_client, customer):
+        api_client.force_authenticate(user=baker.make(User, is_staff=True, is_superuser=True))
+        return api_client.get(f'/store/api/customers/{customer.id}/history/')
+
+    def test_checkout_and_payment_update_the_summary(self, api_client):
+        customer = baker.make(Customer)
+        pen = baker.make(Product, title='Pen', unit_price=Decimal('2.00'), inventory=100)
+        ink = baker.make(Product, title='Ink', unit_price=Decimal('5.00'), inventory=100)
+        self.checkout(api_client, customer, {pen: 3, ink: 1})
+        response = self.checkout(api_client, customer, {pen: 2})
+        order = Order.objects.get(pk=response.data['id'])
+        order.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+
+        response = self.get_history(api_client, customer)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['orders_count'] == 2
+        assert Decimal(response.data['total_spent']) == Decimal('4.00')
+        assert response.data['last_order_at'] is not None
+        assert response.data['top_products'] == [
+            {'product_id': pen.id, 'quantity': 5, 'title': 'Pen'},
+            {'product_id': ink.id, 'quantity': 1, 'title': 'Ink'},
+        ]
+
+    def test_customer_without_orders_gets_an_empty_summary(self, api_client):
+        customer = baker.make(Customer)
+
+        response = self.get_history(api_client, customer)
+
+        assert response.data['orders_count'] == 0
+        assert response.data['top_products'] == []
+
+    def test_is_served_by_one_lookup(self, api_client, django_assert_num_queries):
+        customer = baker.make(Customer)
+        self.checkout(api_client, customer, {baker.make(Product, inventory=1): 1})
+        api_client.force_authenticate(user=baker.make(User, is_staff=True, is_superuser=True))
+
+        with django_assert_num_queries(1):
+            api_client.get(f'/store/api/customers/{customer.id}/history/')
+
+    def test_backfill_matches_incremental_summary(self, api_client):
+        customer = baker.make(Customer)
+        products = baker.make(Product, inventory=100, _quantity=7)
+        for index, product in enumerate(products):
+            self.checkout(api_client, customer, {product: index + 1, products[0]: 1})
+        Order.objects.filter(pk=Order.objects.first().pk) \
+            .update(payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        CustomerHistory.objects.filter(pk=customer.pk).delete()
+        baker.make(Order, customer=customer, payment_status=Order.PAYMENT_STATUS_COMPLETE)
+
+        call_command('backfill_customer_history', batch_size=1)
+
+        history = CustomerHistory.objects.get(pk=customer.pk)
+        assert history.orders_count == 8
+        assert history.total_spent == products[0].unit_price
+        assert [row['product_id'] for row in history.top_products] == \
+            [products[0].id] + [product.id for product in reversed(products[3:])]
@@ -1,7 +1,10 @@
 import pytest
 from model_bakery import baker
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from store.facets import get_facets
 from store.filters import ProductFilter
-from store.models import Product, Collection
+from store.models import Product, Collection, TaxRate
 from decimal import Decimal
 
 
@@ -129,3 +132,62 @@ class TestProductFilter:
         filtered_products = filter_set.qs
 
         assert filtered_products.count() == 0
+
+
+@pytest.mark.django_db
+class TestProductFacets:
+
+    def test_facets_follow_current_filters(self, api_client):
+        collection1 = baker.make(Collection)
+        collection2 = baker.make(Collection)
+        baker.make(Product, collection=collection1,
+                   unit_price=Decimal('5.00'), inventory=0)
+        baker.make(Product, collection=collection1,
+                   unit_price=Decimal('30.00'), inventory=3)
+        baker.make(Product, collection=collection2,
+                   unit_price=Decimal('150.00'), inventory=1)
+
+        response = api_client.get(
+            '/store/api/products/?facets=1&unit_price__lt=100')
+
+        facets = response.data['facets']
+        assert facets['collections'] == [{'id': collection1.id, 'count': 2}]
+        assert [bucket['count'] for bucket in facets['price']] == [1, 0, 1, 0, 0]
+        assert facets['in_stock'] == 1
+
+    def test_facets_are_computed_in_one_query(self, django_assert_num_queries):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=3)
+
+        with django_assert_num_queries(1):
+            facets = get_facets(Product.objects.all(), Request(
+                APIRequestFactory().get('/store/api/products/')))
+
+        assert facets['collections'] == [{'id': collection.id, 'count': 3}]
+
+    def test_tax_rate_change_refreshes_price_with_tax_facets(self, api_client, django_capture_on_commit_callbacks):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, unit_price=Decimal('100.00'))
+        url = '/store/api/products/?facets=1&price_with_tax__lt=120'
+        before = api_client.get(url).data['facets']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(TaxRate, region='', collection=collection, rate=Decimal('0.5'))
+
+        after = api_client.get(url).data['facets']
+        assert before['collections'] == [{'id': collection.id, 'count': 1}]
+        assert after['collections'] == []
+
+    def test_sparse_fields_share_cached_facets(self, django_assert_num_queries):
+        baker.make(Product, collection=baker.make(Collection))
+        factory = APIRequestFactory()
+        get_facets(Product.objects.all(), Request(factory.get('/store/api/products/')))
+
+        with django_assert_num_queries(0):
+            get_facets(Product.objects.all(), Request(
+                factory.get('/store/api/products/?fields=id,title&exclude=images')))
+
+    def test_facets_are_omitted_unless_requested(self, api_client):
+        response = api_client.get('/store/api/products/')
+
+        assert 'facets' not in response.data
@@ -0,0 +1,88 @@
+import threading
+import time
+from django.core.cache import cache
+from store import idempotency
+from store.serializers import CreateOrderSerializer
+from store.models import Cart, CartItem, Collection, Customer, Order, Product
+from rest_framework import status
+from rest_framework.test import APIClient
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def checkout():
+    customer = baker.make(Customer)
+    cart = baker.make(Cart)
+    product = baker.make(Product, collection=baker.make(Collection), inventory=10)
+    baker.make(CartItem, cart=cart, product=product, quantity=1)
+
+    def do_checkout(key, cart_id=cart.id):
+        # A client per call: APIClient isn't safe to share across threads
+        client = APIClient()
+        client.force_authenticate(user=customer.user)
+        return client.post('/store/api/orders/', {'cart_id': str(cart_id)},
+                           HTTP_IDEMPOTENCY_KEY=key)
+    return do_checkout
+
+
+@pytest.mark.django_db
+class TestIdempotencyKeys:
+
+    def test_retried_order_is_replayed_not_repeated(self, checkout):
+        first = checkout('retry-1')
+        second = checkout('retry-1')
+
+        assert first.status_code == status.HTTP_200_OK
+        assert second.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+        assert second['Idempotent-Replayed'] == 'true'
+        assert Order.objects.count() == 1
+
+    def test_key_reused_with_other_body_returns_422(self, checkout):
+        checkout('retry-2')
+
+        response = checkout('retry-2', cart_id='11111111-1111-1111-1111-111111111111')
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_cart_item_post_is_replayed(self, api_client):
+        cart = baker.make(Cart)
+        product = baker.make(Product, collection=baker.make(Collection))
+
+        for _ in range(2):
+            api_client.post(f'/store/api/carts/{cart.id}/items/',
+                            {'product_id': product.id, 'quantity': 1},
+                            HTTP_IDEMPOTENCY_KEY='add-1')
+
+        assert CartItem.objects.get(cart=cart).quantity == 1
+
+    def test_duplicate_waits_for_request_in_progress(self, checkout, monkeypatch):
+        save = CreateOrderSerializer.save
+
+        def slow_save(serializer, **kwargs):
+            time.sleep(0.3)
+            return save(serializer, **kwargs)
+        monkeypatch.setattr(CreateOrderSerializer, 'save', slow_save)
+
+        # The duplicate arrives while the first request holds the lock. It
+        # never touches the database, so it can run on its own thread.
+        duplicate = {}
+        thread = threading.Timer(
+            0.1, lambda: duplicate.update(response=checkout('retry-3')))
+        thread.start()
+        first = checkout('retry-3')
+        thread.join()
+
+        assert duplicate['response'].data == first.data
+        assert duplicate['response']['Idempotent-Replayed'] == 'true'
+        assert Order.objects.count() == 1
+
+    def test_expired_lock_taken_by_another_request_is_kept(self):
+        cache.set('store:idempotency:test:lock', 'other-token', idempotency.LOCK_TIMEOUT)
+
+        idempotency.release_lock('store:idempotency:test:lock', 'our-token')
+
+        assert cache.get('store:idempotency:test:lock') == 'other-token'
+        idempotency.release_lock('store:idempotency:test:lock', 'other-token')
+        assert cache.get('store:idempotency:test:lock') is None
@@ -1,5 +1,13 @@
-from store.models import Order, OrderItem, Customer, Cart, CartItem, Product, Collection
+import csv
+import io
+import json
+from django.core.management import call_command
+from store.payments import set_payment_statuses
+from store.models import CustomerHistory, InsufficientInventory, ProductQuerySet, Order, OrderItem, OutboxEvent, Customer, Cart, CartItem, Product, Collection
+from concurrent.futures import ThreadPoolExecutor
 from core.models import User
+from django.db import connection
+from rest_framework.test import APIClient
 from rest_framework import status
 import pytest
 from model_bakery import baker
@@ -106,3 +114,241 @@ class TestListOrders:
         response = api_client.get('/store/orders/')
 
         assert response.status_code == status.HTTP_200_OK
+
+    def test_lists_only_own_orders_newest_first_in_pages(self, api_client):
+        customer = baker.make(Customer)
+        baker.make(Order, _quantity=3)
+        orders = baker.make(Order, customer=customer, _quantity=12)
+        api_client.force_authenticate(user=customer.user)
+
+        first = api_client.get('/store/api/orders/')
+        second = api_client.get(first.data['next'])
+
+        ids = [order['id'] for order in first.data['results'] + second.data['results']]
+        expected = sorted(orders, key=lambda order: (order.placed_at, order.id), reverse=True)
+        assert ids == [order.id for order in expected]
+        assert second.data['next'] is None
+
+    def test_response_is_the_page_the_order_list_template_reads(self, api_client):
+        # store/order_list.html renders `results` and follows `next`.
+        customer = baker.make(Customer)
+        order = baker.make(Order, customer=customer)
+        api_client.force_authenticate(user=customer.user)
+
+        response = api_client.get('/store/api/orders/')
+
+        assert set(response.data) == {'next', 'previous', 'results'}
+        assert [o['id'] for o in response.data['results']] == [order.id]
+        assert response.data['next'] is None
+
+    def test_query_count_does_not_grow_with_items(self, api_client, django_assert_max_num_queries):
+        customer = baker.make(Customer)
+        product = baker.make(Product)
+        for order in baker.make(Order, customer=customer, _quantity=10):
+            baker.make(OrderItem, order=order, product=product, _quantity=3)
+        api_client.force_authenticate(user=customer.user)
+
+        # Session/auth lookups aside: orders, items, products, archived orders
+        with django_assert_max_num_queries(4):
+            response = api_client.get('/store/api/orders/')
+
+        assert len(response.data['results']) == 10
+        assert len(response.data['results'][0]['items']) == 3
+
+    def test_staff_can_filter_by_status_and_date(self, api_client):
+        api_client.force_authenticate(user=User(is_staff=True))
+        complete = baker.make(Order, payment_status='C')
+        baker.make(Order, payment_status='P')
+
+        response = api_client.get('/store/api/orders/', {
+            'payment_status': 'C',
+            'placed_at__gte': complete.placed_at.isoformat(),
+        })
+
+        assert [order['id'] for order in response.data['results']] == [complete.id]
+
+
+@pytest.mark.django_db
+class TestBulkUpdateOrders:
+
+    def test_if_user_is_not_admin_returns_403(self, api_client):
+        api_client.force_authenticate(user=baker.make(Customer).user)
+
+        response = api_client.post('/store/api/orders/bulk_update/', {'orders': []}, format='json')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_applies_allowed_transitions_with_one_event(self, api_client):
+        api_client.force_authenticate(user=User(is_staff=True))
+        pending = baker.make(Order, payment_status='P', _quantity=3)
+        failed = baker.make(Order, payment_status='F')
+        complete = baker.make(Order, payment_status='C')
+        payload = {'orders': [
+            *[{'id': order.id, 'payment_status': 'C'} for order in pending[:2]],
+            {'id': pending[2].id, 'payment_status': 'F'},
+            {'id': failed.id, 'payment_status': 'C'},
+            {'id': complete.id, 'payment_status': 'F'},
+            {'id': 999999, 'payment_status': 'C'},
+        ]}
+
+        response = api_client.post('/store/api/orders/bulk_update/', payload, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['updated'] == {
+            'C': sorted([pending[0].id, pending[1].id, failed.id]), 'F': [pending[2].id]}
+        assert response.data['skipped'] == [complete.id, 999999]
+        assert Order.objects.get(pk=complete.pk).payment_status == 'C'
+        assert list(OutboxEvent.objects.values_list('topic', flat=True)) == ['payment_status_changed']
+
+    def test_moves_spend_into_customer_history(self):
+        customer = baker.make(Customer)
+        order = baker.make(Order, customer=customer, payment_status='P')
+        baker.make(OrderItem, order=order, quantity=2, unit_price=3)
+        CustomerHistory.objects.create(customer=customer, orders_count=1)
+
+        set_payment_statuses({order.id: 'C'})
+
+        assert CustomerHistory.objects.get(pk=customer.pk).total_spent == 6
+
+    def test_if_order_is_listed_twice_returns_400(self, api_client):
+        api_client.force_authenticate(user=User(is_staff=True))
+        order = baker.make(Order)
+
+        response = api_client.post('/store/api/orders/bulk_update/', {'orders': [
+            {'id': order.id, 'payment_status': 'C'}, {'id': order.id, 'payment_status': 'F'}]},
+            format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestExportOrders:
+
+    def make_orders(self):
+        product = baker.make(Product)
+        complete = baker.make(Order, payment_status='C')
+        baker.make(OrderItem, order=complete, product=product, quantity=2, _quantity=2)
+        pending = baker.make(Order, payment_status='P')
+        return complete, pending
+
+    def test_if_user_is_not_admin_returns_403(self, api_client):
+        api_client.force_authenticate(user=baker.make(Customer).user)
+
+        response = api_client.get('/store/api/orders/export/')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_streams_csv_row_per_item(self, api_client):
+        api_client.force_authenticate(user=User(is_staff=True))
+        complete, pending = self.make_orders()
+
+        response = api_client.get('/store/api/orders/export/')
+
+        assert response.streaming
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        assert [int(row['order_id']) for row in rows] == [complete.id, complete.id, pending.id]
+        assert rows[0]['quantity'] == '2'
+        assert rows[2]['product_id'] == ''
+
+    def test_streams_filtered_ndjson(self, api_client):
+        api_client.force_authenticate(user=User(is_staff=True))
+        complete, _ = self.make_orders()
+
+        response = api_client.get('/store/api/orders/export/', {'output': 'ndjson', 'payment_status': 'C'})
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        orders = [json.loads(line) for line in lines]
+        assert [order['id'] for order in orders] == [complete.id]
+        assert len(orders[0]['items']) == 2
+        assert orders[0]['placed_at'] == complete.placed_at.isoformat()
+
+    def test_command_writes_same_orders_across_batches(self, tmp_path):
+        complete, pending = self.make_orders()
+        path = tmp_path / 'orders.ndjson'
+
+        call_command('export_orders', format='ndjson', batch_size=1, output=str(path))
+
+        orders = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [order['id'] for order in orders] == [complete.id, pending.id]
+
+
+@pytest.mark.django_db
+class TestInventoryReservation:
+
+    def checkout(self, api_client, quantities):
+        customer = baker.make(Customer)
+        api_client.force_authenticate(user=customer.user)
+        cart = baker.make(Cart)
+        for product, quantity in quantities.items():
+            baker.make(CartItem, cart=cart, product=product, quantity=quantity)
+        return api_client.post('/store/api/orders/', {'cart_id': str(cart.id)})
+
+    def test_checkout_decrements_inventory(self, api_client):
+        collection = baker.make(Collection)
+        first = baker.make(Product, collection=collection, inventory=5)
+        second = baker.make(Product, collection=collection, inventory=3)
+
+        response = self.checkout(api_client, {first: 2, second: 3})
+
+        assert response.status_code == status.HTTP_200_OK
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert (first.inventory, second.inventory) == (3, 0)
+
+    def test_short_line_returns_400_and_reserves_nothing(self, api_client):
+        collection = baker.make(Collection)
+        plenty = baker.make(Product, collection=collection, inventory=10)
+        short = baker.make(Product, collection=collection, inventory=1, title='Scarce')
+
+        response = self.checkout(api_client, {plenty: 2, short: 2})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Scarce' in response.data['cart_id'][0]
+        plenty.refresh_from_db()
+        assert plenty.inventory == 10
+        assert not Order.objects.exists()
+
+    def test_restock_during_checkout_asks_to_retry(self, api_client, monkeypatch):
+        def reserve(self, quantities):
+            # The UPDATE fell short but every line fits by the re-read
+            raise InsufficientInventory([])
+        monkeypatch.setattr(ProductQuerySet, 'reserve', reserve)
+        product = baker.make(Product, collection=baker.make(Collection), inventory=5)
+
+        response = self.checkout(api_client, {product: 1})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'try again' in response.data['cart_id'][0]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentCheckout:
+
+    def test_concurrent_checkouts_never_oversell(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            pytest.skip('Shared-cache in-memory SQLite fails on locks instead of waiting.')
+        product = baker.make(Product, collection=baker.make(Collection), inventory=5)
+        clients = []
+        for _ in range(12):
+            customer = baker.make(Customer)
+            cart = baker.make(Cart)
+            baker.make(CartItem, cart=cart, product=product, quantity=1)
+            client = APIClient()
+            client.force_authenticate(user=customer.user)
+            clients.append((client, cart.id))
+
+        def checkout(args):
+            client, cart_id = args
+            try:
+                return client.post('/store/api/orders/', {'cart_id': str(cart_id)})
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            responses = list(executor.map(checkout, clients))
+
+        product.refresh_from_db()
+        succeeded = [r for r in responses if r.status_code == status.HTTP_200_OK]
+        assert len(succeeded) == 5
+        assert product.inventory == 0
+        assert OrderItem.objects.count() == 5
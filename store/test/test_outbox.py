@@ -0,0 +1,69 @@
+from store import outbox
+from store.models import Cart, CartItem, Collection, Customer, Order, OutboxEvent, Product
+from store.signals import order_created
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def receiver():
+    calls = []
+
+    def on_order_created(sender, order, **kwargs):
+        if receiver.fail:
+            raise RuntimeError('ERP is down')
+        calls.append(order.id)
+
+    receiver.fail = False
+    receiver.calls = calls
+    order_created.connect(on_order_created)
+    yield receiver
+    order_created.disconnect(on_order_created)
+
+
+@pytest.mark.django_db
+class TestOutbox:
+
+    def test_checkout_records_event_instead_of_calling_receivers(self, api_client, receiver):
+        customer = baker.make(Customer)
+        api_client.force_authenticate(user=customer.user)
+        cart = baker.make(Cart)
+        product = baker.make(Product, collection=baker.make(Collection), inventory=5)
+        baker.make(CartItem, cart=cart, product=product, quantity=1)
+
+        response = api_client.post('/store/api/orders/', {'cart_id': str(cart.id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        event = OutboxEvent.objects.get()
+        assert (event.topic, event.payload) == ('order_created', {'order_id': response.data['id']})
+        assert receiver.calls == []
+
+    def test_dispatch_delivers_and_deletes_events(self, receiver):
+        orders = baker.make(Order, _quantity=3)
+        for order in orders:
+            outbox.publish('order_created', order_id=order.id)
+
+        delivered = outbox.dispatch(batch_size=2)
+
+        assert delivered == 3
+        assert receiver.calls == [order.id for order in orders]
+        assert not OutboxEvent.objects.exists()
+
+    def test_failed_delivery_is_retried_later(self, receiver):
+        order = baker.make(Order)
+        outbox.publish('order_created', order_id=order.id)
+        receiver.fail = True
+
+        assert outbox.dispatch() == 0
+
+        event = OutboxEvent.objects.get()
+        assert event.attempts == 1
+        assert 'ERP is down' in event.last_error
+        # Backed off, so an immediate second run leaves it alone
+        assert outbox.dispatch() == 0
+        assert OutboxEvent.objects.get().attempts == 1
+
+    def test_unknown_topic_is_rejected(self):
+        with pytest.raises(ValueError):
+            outbox.publish('order_shipped', order_id=1)
@@ -1,3 +1,6 @@
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from store.models import Product, Collection, OrderItem
 from rest_framework import status
 import pytest
@@ -172,3 +175,147 @@ class TestListProducts:
 
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['results']) == 3
+
+
+@pytest.mark.django_db
+class TestPaginateProducts:
+
+    def walk(self, api_client, url):
+        ids = []
+        while url:
+            response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            ids += [product['id'] for product in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_keyset_pages_cover_all_products_once(self, api_client):
+        collection = baker.make(Collection)
+        products = baker.make(Product, collection=collection,
+                              unit_price=Decimal('5.00'), _quantity=25)
+
+        ids = self.walk(api_client,
+                        '/store/api/products/?ordering=-unit_price&limit=7')
+
+        assert sorted(ids) == sorted(product.id for product in products)
+        assert len(ids) == len(set(ids))
+
+    def test_keyset_previous_link_returns_previous_page(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=12)
+
+        first = api_client.get('/store/api/products/?limit=5')
+        second = api_client.get(first.data['next'])
+        back = api_client.get(second.data['previous'])
+
+        assert back.data['results'] == first.data['results']
+        assert back.data['previous'] is None
+
+    def test_keyset_does_not_count(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=3)
+
+        with CaptureQueriesContext(connection) as context:
+            response = api_client.get('/store/api/products/')
+
+        assert 'count' not in response.data
+        assert not any('COUNT(' in query['sql'] for query in context)
+
+    def test_page_number_is_opt_in(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=3)
+
+        response = api_client.get('/store/api/products/?page=1')
+
+        assert response.data['count'] == 3
+
+    def test_invalid_cursor_returns_404(self, api_client):
+        response = api_client.get('/store/api/products/?cursor=bogus')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestBatchProducts:
+
+    def test_returns_products_in_requested_order(self, api_client):
+        collection = baker.make(Collection)
+        first, second = baker.make(Product, collection=collection, _quantity=2)
+
+        response = api_client.get(
+            f'/store/api/products/batch/?ids={second.id},{first.id}')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [p['id'] for p in response.data['results']] == [second.id, first.id]
+        assert response.data['missing'] == []
+
+    def test_reports_missing_ids(self, api_client):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection)
+
+        response = api_client.get(
+            f'/store/api/products/batch/?ids={product.id},999999')
+
+        assert [p['id'] for p in response.data['results']] == [product.id]
+        assert response.data['missing'] == [999999]
+
+    def test_uses_one_product_and_one_image_query(self, api_client, django_assert_num_queries):
+        collection = baker.make(Collection)
+        products = baker.make(Product, collection=collection, _quantity=5)
+        ids = ','.join(str(product.id) for product in products)
+        api_client.get('/store/api/products/batch/?ids=0')  # loads tax rates
+
+        with django_assert_num_queries(2):
+            api_client.get(f'/store/api/products/batch/?ids={ids}')
+
+    def test_if_ids_are_invalid_returns_400(self, api_client):
+        response = api_client.get('/store/api/products/batch/?ids=1,abc')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_too_many_ids_returns_400(self, api_client):
+        ids = ','.join(str(id) for id in range(1, 102))
+
+        response = api_client.get(f'/store/api/products/batch/?ids={ids}')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestSparseFieldsets:
+
+    def test_fields_limits_list_output(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection)
+
+        response = api_client.get('/store/api/products/?fields=id,title')
+
+        assert list(response.data['results'][0].keys()) == ['id', 'title']
+
+    def test_exclude_limits_detail_output(self, api_client):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection)
+
+        response = api_client.get(
+            f'/store/api/products/{product.id}/?exclude=description,images')
+
+        assert 'description' not in response.data
+        assert 'images' not in response.data
+        assert response.data['title'] == product.title
+
+    def test_unrequested_description_and_images_are_not_queried(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection)
+        api_client.get('/store/api/products/?limit=1')  # loads tax rates
+
+        with CaptureQueriesContext(connection) as context:
+            api_client.get('/store/api/products/?exclude=description,images')
+
+        sql = ' '.join(query['sql'] for query in context)
+        assert 'description' not in sql
+        assert 'store_productimage' not in sql
+
+    def test_unknown_field_returns_400(self, api_client):
+        response = api_client.get('/store/api/products/?fields=id,secret')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
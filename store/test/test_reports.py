@@ -0,0 +1,92 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from core.models import User
+from store import reports
+from store.models import Collection, CollectionSales, Order, OrderItem, Product, ProductSales
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+def make_order(day, items, payment_status=Order.PAYMENT_STATUS_COMPLETE):
+    order = baker.make(Order, payment_status=payment_status)
+    Order.objects.filter(pk=order.pk).update(
+        placed_at=datetime.combine(day, datetime.min.time(), timezone.utc).replace(hour=12))
+    order.refresh_from_db()
+    for product, quantity in items.items():
+        baker.make(OrderItem, order=order, product=product,
+                   quantity=quantity, unit_price=product.unit_price)
+    return order
+
+
+@pytest.mark.django_db
+class TestSalesRollups:
+
+    def test_folds_complete_orders_per_day(self):
+        collection = baker.make(Collection)
+        pen = baker.make(Product, collection=collection, unit_price=Decimal('2.00'))
+        ink = baker.make(Product, collection=collection, unit_price=Decimal('5.00'))
+        make_order(date(2026, 3, 1), {pen: 3, ink: 1})
+        make_order(date(2026, 3, 1), {pen: 1})
+        make_order(date(2026, 3, 2), {ink: 2})
+        make_order(date(2026, 3, 2), {ink: 9}, payment_status=Order.PAYMENT_STATUS_PENDING)
+
+        assert reports.refresh_sales_rollups() == 2
+
+        sales = ProductSales.objects.get(date=date(2026, 3, 1), product=pen)
+        assert (sales.units, sales.revenue, sales.orders) == (4, Decimal('8.00'), 2)
+        sales = CollectionSales.objects.get(date=date(2026, 3, 2), collection=collection)
+        assert (sales.units, sales.revenue, sales.orders) == (2, Decimal('10.00'), 1)
+
+    def test_refolds_only_days_with_changed_orders(self):
+        product = baker.make(Product, unit_price=Decimal('1.00'))
+        make_order(date(2026, 3, 1), {product: 1})
+        pending = make_order(date(2026, 3, 2), {product: 5},
+                             payment_status=Order.PAYMENT_STATUS_PENDING)
+        reports.refresh_sales_rollups()
+        reports.ReportWatermark.objects.update(value=datetime.now(timezone.utc))
+
+        pending.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        pending.save()
+
+        assert reports.refresh_sales_rollups() == 1
+        assert ProductSales.objects.get(date=date(2026, 3, 2)).units == 5
+
+
+@pytest.mark.django_db
+class TestSalesReport:
+
+    def test_if_user_is_not_admin_returns_403(self, authenticate, api_client):
+        authenticate()
+
+        response = api_client.get('/store/api/reports/sales/products/',
+                                  {'start': '2026-03-01', 'end': '2026-03-31'})
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_returns_rows_per_day_or_over_the_range(self, api_client):
+        api_client.force_authenticate(user=User(is_staff=True))
+        first, second = baker.make(Product, unit_price=Decimal('3.00'), _quantity=2)
+        make_order(date(2026, 3, 1), {first: 1, second: 1})
+        make_order(date(2026, 3, 2), {first: 2})
+        make_order(date(2026, 4, 1), {first: 10})
+        reports.refresh_sales_rollups()
+        params = {'start': '2026-03-01', 'end': '2026-03-31'}
+
+        daily = api_client.get('/store/api/reports/sales/products/', params)
+        total = api_client.get('/store/api/reports/sales/products/',
+                               {**params, 'group_by': 'range', 'id': [first.id]})
+
+        assert daily.status_code == status.HTTP_200_OK
+        assert [(row['date'], row['product_id'], row['units']) for row in daily.data['results']] == [
+            ('2026-03-01', first.id, 1), ('2026-03-01', second.id, 1), ('2026-03-02', first.id, 2)]
+        assert total.data['results'] == [
+            {'units': 3, 'revenue': Decimal('9.00'), 'orders': 2, 'product_id': first.id}]
+
+    def test_if_range_is_inverted_returns_400(self, api_client):
+        api_client.force_authenticate(user=User(is_staff=True))
+
+        response = api_client.get('/store/api/reports/sales/collections/',
+                                  {'start': '2026-03-31', 'end': '2026-03-01'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
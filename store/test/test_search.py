@@ -0,0 +1,102 @@
+from store.models import Product, Collection, ProductSearchTerm
+from store import search
+from store.search import rebuild_index, tokenize
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def make_product():
+    def do_make_product(title, description=''):
+        collection = baker.make(Collection)
+        return baker.make(Product, collection=collection,
+                          title=title, description=description)
+    return do_make_product
+
+
+def test_tokenize_lowercases_and_drops_short_words():
+    assert tokenize('A Red-Wine GLASS') == ['red', 'wine', 'glass']
+
+
+@pytest.mark.django_db
+class TestSearchIndex:
+
+    def test_saving_product_updates_terms(self, make_product):
+        product = make_product('Coffee Mug')
+
+        product.title = 'Tea Cup'
+        product.save()
+
+        terms = set(product.search_terms.values_list('term', flat=True))
+        assert terms == {'tea', 'cup'}
+
+    def test_deleting_product_removes_terms(self, make_product):
+        product = make_product('Coffee Mug')
+
+        product.delete()
+
+        assert not ProductSearchTerm.objects.exists()
+
+    def test_rebuild_index_covers_products_saved_without_signals(self, make_product):
+        product = make_product('Coffee Mug')
+        Product.objects.filter(pk=product.pk).update(title='Tea Cup')
+
+        rebuild_index()
+
+        terms = set(product.search_terms.values_list('term', flat=True))
+        assert terms == {'tea', 'cup'}
+
+    def test_failed_rebuild_keeps_the_old_index(self, make_product, monkeypatch):
+        product = make_product('Coffee Mug')
+
+        def fail(product):
+            raise RuntimeError
+        monkeypatch.setattr(search, 'get_terms', fail)
+        with pytest.raises(RuntimeError):
+            rebuild_index()
+
+        terms = set(product.search_terms.values_list('term', flat=True))
+        assert terms == {'coffee', 'mug'}
+
+
+@pytest.mark.django_db
+class TestSearchProducts:
+
+    def test_title_matches_rank_above_description_matches(self, api_client, make_product):
+        in_description = make_product('Plate', 'Goes well with coffee')
+        in_title = make_product('Coffee Mug')
+
+        response = api_client.get('/store/api/products/?search=coffee')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [p['id'] for p in response.data['results']] == [
+            in_title.id, in_description.id]
+
+    def test_every_word_must_match(self, api_client, make_product):
+        make_product('Coffee Mug')
+        both = make_product('Coffee Grinder')
+
+        response = api_client.get('/store/api/products/?search=coff grind')
+
+        assert [p['id'] for p in response.data['results']] == [both.id]
+
+    def test_search_results_page_by_relevance(self, api_client, make_product):
+        products = [make_product(f'Coffee {i}') for i in range(5)]
+
+        ids = []
+        url = '/store/api/products/?search=coffee&limit=2'
+        while url:
+            response = api_client.get(url)
+            ids += [p['id'] for p in response.data['results']]
+            url = response.data['next']
+
+        assert sorted(ids) == sorted(p.id for p in products)
+
+    def test_catalog_page_uses_index(self, client, make_product):
+        product = make_product('Coffee Mug')
+        make_product('Tea Cup')
+
+        response = client.get('/store/products/?search=mug')
+
+        assert list(response.context['products']) == [product]
@@ -6,11 +6,17 @@ from store.serializers import (
     CartSerializer, CartItemSerializer, AddCartItemSerializer,
     UpdateCartItemSerializer, CustomerSerializer, OrderSerializer,
     OrderItemSerializer, CreateOrderSerializer, UpdateOrderSerializer,
-    SimpleProductSerializer, ProductImageSerializer
+    SimpleProductSerializer, ProductImageSerializer, ProductRowSerializer
 )
 from store.models import (
-    Collection, Product, Review, Cart, CartItem, Customer, Order, OrderItem
+    Collection, Product, ProductImage, Review, Cart, CartItem, Customer,
+    Order, OrderItem
 )
+from store.taxes import annotate_price_with_tax
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 from core.models import User
 
 
@@ -156,9 +162,12 @@ class TestAddCartItemSerializer:
         data = {'product_id': 9999, 'quantity': 1}
         serializer = AddCartItemSerializer(
             data=data, context={'cart_id': cart.id})
+        serializer.is_valid()
 
-        assert not serializer.is_valid()
-        assert 'product_id' in serializer.errors
+        # The upsert itself rejects unknown products, not a lookup beforehand
+        with pytest.raises(ValidationError) as error:
+            serializer.save()
+        assert 'product_id' in error.value.detail
 
 
 @pytest.mark.django_db
@@ -241,3 +250,34 @@ class TestUpdateOrderSerializer:
         updated_order = serializer.save()
 
         assert updated_order.payment_status == 'C'
+
+
+@pytest.mark.django_db
+class TestProductRowSerializer:
+
+    def test_renders_same_json_as_product_serializer(self):
+        collection = baker.make(Collection)
+        products = baker.make(Product, collection=collection, _quantity=3)
+        baker.make(Product, collection=collection, description=None)
+        for name in ['store/images/a.jpg', 'store/images/b.jpg']:
+            baker.make(ProductImage, product=products[0], image=name)
+        request = Request(APIRequestFactory().get('/store/api/products/'))
+        queryset = annotate_price_with_tax(Product.objects.order_by('id'))
+
+        expected = ProductSerializer(
+            queryset.prefetch_related('images'), many=True,
+            context={'request': request}).data
+        actual = ProductRowSerializer(
+            queryset.values(), many=True, context={'request': request}).data
+
+        renderer = JSONRenderer()
+        assert renderer.render(actual) == renderer.render(expected)
+
+    def test_loads_images_in_one_query(self, django_assert_num_queries):
+        collection = baker.make(Collection)
+        for product in baker.make(Product, collection=collection, _quantity=3):
+            baker.make(ProductImage, product=product, image='store/images/a.jpg')
+        rows = list(annotate_price_with_tax(Product.objects.all()).values())
+
+        with django_assert_num_queries(1):
+            ProductRowSerializer(rows, many=True).data
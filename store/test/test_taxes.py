@@ -0,0 +1,97 @@
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.test import override_settings
+from store.models import Product, Collection, TaxRate
+from store.taxes import annotate_price_with_tax, get_price_with_tax
+from rest_framework import status
+import pytest
+from model_bakery import baker
+
+
+@pytest.fixture
+def collection():
+    return baker.make(Collection)
+
+
+@pytest.fixture
+def make_rate(django_capture_on_commit_callbacks):
+    def do_make_rate(rate, region='', collection=None):
+        with django_capture_on_commit_callbacks(execute=True):
+            return TaxRate.objects.create(
+                region=region, collection=collection, rate=Decimal(rate))
+    return do_make_rate
+
+
+def price_with_tax(product, region=None):
+    queryset = annotate_price_with_tax(Product.objects.filter(pk=product.pk), region)
+    return queryset.get().price_with_tax
+
+
+@pytest.mark.django_db
+class TestTaxRates:
+
+    def test_default_rate_applies_without_rows(self, collection):
+        product = baker.make(Product, collection=collection,
+                             unit_price=Decimal('100.00'))
+
+        assert price_with_tax(product) == Decimal('110.00')
+
+    def test_collection_rate_overrides_default(self, collection, make_rate):
+        make_rate('0.05', collection=collection)
+        product = baker.make(Product, collection=collection,
+                             unit_price=Decimal('100.00'))
+        other = baker.make(Product, unit_price=Decimal('100.00'))
+
+        assert price_with_tax(product) == Decimal('105.00')
+        assert price_with_tax(other) == Decimal('110.00')
+
+    def test_region_rate_overrides_catch_all_rates(self, collection, make_rate):
+        make_rate('0.05', collection=collection)
+        make_rate('0.20', region='DE')
+        product = baker.make(Product, collection=collection,
+                             unit_price=Decimal('100.00'))
+
+        assert price_with_tax(product, region='DE') == Decimal('120.00')
+
+    @override_settings(TAX_REGION='DE')
+    def test_python_fallback_matches_annotation(self, collection, make_rate):
+        make_rate('0.19', region='DE', collection=collection)
+        product = baker.make(Product, collection=collection,
+                             unit_price=Decimal('9.99'))
+
+        assert get_price_with_tax(product) == price_with_tax(product)
+
+
+@pytest.mark.django_db
+class TestPriceWithTaxApi:
+
+    def test_can_filter_and_order_by_price_with_tax(self, api_client, collection, make_rate):
+        make_rate('0.50', collection=collection)
+        cheap = baker.make(Product, collection=collection, unit_price=Decimal('10.00'))
+        baker.make(Product, collection=collection, unit_price=Decimal('20.00'))
+        baker.make(Product, unit_price=Decimal('25.00'))
+
+        response = api_client.get(
+            '/store/api/products/?price_with_tax__gt=20&ordering=-price_with_tax')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [p['price_with_tax'] for p in response.data['results']] == [
+            Decimal('30.00'), Decimal('27.50')]
+        assert cheap.id not in [p['id'] for p in response.data['results']]
+
+
+@pytest.mark.django_db
+class TestTaxRateValidation:
+
+    def test_second_catch_all_rate_for_region_is_rejected(self):
+        TaxRate.objects.create(region='EU', rate=Decimal('0.2'))
+
+        with pytest.raises(ValidationError):
+            TaxRate(region='EU', rate=Decimal('0.1')).full_clean()
+
+    def test_catch_all_rate_can_be_edited(self, collection):
+        rate = TaxRate.objects.create(region='EU', rate=Decimal('0.2'))
+        TaxRate.objects.create(region='EU', collection=collection, rate=Decimal('0.1'))
+
+        rate.rate = Decimal('0.25')
+        rate.full_clean()
@@ -11,6 +11,7 @@ router.register('collections', views.CollectionViewSet, basename='collections')
 router.register('carts', views.CartViewSet)
 router.register('customers', views.CustomerViewSet)
 router.register('orders', views.OrderViewSet, basename='orders')
+router.register('reports/sales', views.SalesReportViewSet, basename='sales-reports')
 
 products_router = routers.NestedDefaultRouter(
     router, 'products', lookup='product')
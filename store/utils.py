@@ -1,5 +1,28 @@
+from rest_framework.exceptions import ValidationError
+
+
 def execute_sql_script(cursor, sql_script):
     # Splits the script by semicolon, handling potential empty strings at the end
     sql_statements = [s.strip() for s in sql_script.split(';') if s.strip()]
     for statement in sql_statements:
         cursor.execute(statement)
+
+
+def get_sparse_fields(request, available):
+    """
+    Return the fields picked with ?fields= or dropped with ?exclude=, in
+    the order of `available`, or None when the client asked for everything.
+    """
+    requested = request.query_params.get('fields')
+    excluded = request.query_params.get('exclude')
+    if requested is None and excluded is None:
+        return None
+
+    requested = set(filter(None, requested.split(','))) if requested else set(available)
+    excluded = set(filter(None, excluded.split(','))) if excluded else set()
+    unknown = (requested | excluded) - set(available)
+    if unknown:
+        raise ValidationError(
+            {'fields': [f'Unknown field: {name}' for name in sorted(unknown)]})
+    return tuple(name for name in available
+                 if name in requested and name not in excluded)
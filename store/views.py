@@ -1,33 +1,119 @@
 from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from store.pagination import DefaultPagination
-from django.db.models.aggregates import Count
+from store.caching import CachedResponseMixin, ConditionalGetMixin
+from store.pagination import DefaultPagination, KeysetPagination, OrderPagination
+from store.utils import get_sparse_fields
+from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.views.generic import ListView, DetailView, TemplateView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action, permission_classes
-from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin, UpdateModelMixin
-from rest_framework.permissions import AllowAny, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, IsAdminUser, IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, AllowAny, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework import status
-from .filters import ProductFilter
-from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, ProductImage, Review
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductImageSerializer, ProductSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer
-
-
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.prefetch_related('images').all()
+from django.conf import settings
+from .carts import create_lazy_cart, get_cart_store, get_empty_cart, is_materialized, parse_cart_id, set_materialized
+from . import exports
+from .facets import get_facets
+from .idempotency import idempotent
+from .filters import OrderFilter, ProductFilter, ProductSearchFilter, RelevanceOrderingFilter
+from .models import ArchivedOrder, Cart, CartItem, Collection, CollectionSales, Customer, CustomerHistory, Order, OrderItem, Product, ProductImage, ProductSales, Review, TaxRate
+from .search import search_products
+from .taxes import annotate_price_with_tax
+from .serializers import AddCartItemSerializer, ArchivedOrderSerializer, BulkCartItemSerializer, BulkUpdateOrderSerializer, CartItemSerializer, CartSerializer, CartSummarySerializer, CollectionSalesSerializer, CollectionSerializer, CreateOrderSerializer, CustomerHistorySerializer, CustomerSerializer, OrderSerializer, ProductBatchSerializer, ProductImageSerializer, ProductRowSerializer, ProductSalesSerializer, ProductSerializer, ReviewSerializer, SalesReportQuerySerializer, UpdateCartItemSerializer, UpdateOrderSerializer
+
+
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
+    cache_models = (Product, ProductImage, TaxRate)
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend,
+                       ProductSearchFilter, RelevanceOrderingFilter]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
+    pagination_class = KeysetPagination
     permission_classes = [IsAdminOrReadOnly]
-    search_fields = ['title', 'description']
-    ordering_fields = ['unit_price', 'last_update']
+    ordering_fields = ['unit_price', 'price_with_tax', 'last_update']
+
+    @property
+    def paginator(self):
+        # Clients that need a total count opt into page numbers with ?page=
+        if not hasattr(self, '_paginator'):
+            if DefaultPagination.page_query_param in self.request.query_params:
+                self._paginator = DefaultPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_fields(self):
+        """Output fields picked with ?fields= / ?exclude= on reads."""
+        if self.request.method not in SAFE_METHODS:
+            return None
+        if not hasattr(self, '_fields'):
+            self._fields = get_sparse_fields(
+                self.request, ProductSerializer.Meta.fields)
+        return self._fields
+
+    def get_queryset(self):
+        fields = self.get_fields() or ProductSerializer.Meta.fields
+        queryset = Product.objects.all()
+        if 'images' in fields:
+            images = ProductImage.objects.order_by('id')
+            queryset = queryset.prefetch_related(
+                Prefetch('images', queryset=images))
+        if 'description' not in fields:
+            queryset = queryset.defer('description')
+        return annotate_price_with_tax(queryset)
+
+    def get_rows(self, queryset):
+        """values() rows for ProductRowSerializer, minus pruned columns."""
+        fields = self.get_fields() or ProductSerializer.Meta.fields
+        columns = [field.attname for field in Product._meta.concrete_fields
+                   if field.name != 'description' or 'description' in fields]
+        return queryset \
+            .prefetch_related(None) \
+            .values(*columns, *queryset.query.annotations)
+
+    def get_serializer_class(self):
+        # List pages skip model instances and DRF field machinery
+        if self.action == 'list' and self.request.method == 'GET':
+            return ProductRowSerializer
+        return ProductSerializer
+
+    def paginate_queryset(self, queryset):
+        if self.action == 'list':
+            queryset = self.get_rows(queryset)
+        return super().paginate_queryset(queryset)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.request.query_params.get('facets'):
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facets'] = get_facets(queryset, self.request)
+        return response
 
     def get_serializer_context(self):
-        return {'request': self.request}
+        return {'request': self.request, 'fields': self.get_fields()}
+
+    @action(detail=False)
+    def batch(self, request):
+        return self.get_cached_response(self.get_batch_response, request)
+
+    def get_batch_response(self, request):
+        serializer = ProductBatchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        rows = self.get_rows(self.get_queryset().filter(pk__in=ids))
+        rows = {row['id']: row for row in rows}
+        products = ProductRowSerializer(
+            [rows[id] for id in ids if id in rows], many=True,
+            context=self.get_serializer_context())
+        return Response({
+            'results': products.data,
+            'missing': [id for id in ids if id not in rows],
+        })
 
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
@@ -36,9 +122,9 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(
-        products_count=Count('products')).all()
+class CollectionViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
+    queryset = Collection.objects.all()
+    cache_models = (Collection, Product)
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
 
@@ -49,8 +135,9 @@ class CollectionViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(CachedResponseMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    cache_models = (Review,)
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs['product_pk'])
@@ -73,26 +160,148 @@ class CartViewSet(CreateModelMixin,
             return Cart.objects.prefetch_related('items__product')
         return Cart.objects.all()
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.cart_token = None
+        if 'pk' in self.kwargs:
+            try:
+                self.kwargs['pk'], self.cart_token = parse_cart_id(self.kwargs['pk'])
+            except ValueError:
+                raise Http404
+
+    def get_object(self):
+        cart_store = get_cart_store()
+        if cart_store is not None:
+            cart = cart_store.get(self.kwargs['pk'])
+            if cart is None:
+                raise Http404
+            return cart
+
+        token = self.cart_token
+        if token is None:
+            return super().get_object()
+        # Token carts without items have no row, and no query to find that out
+        if is_materialized(self.kwargs['pk']) is False:
+            return get_empty_cart(Cart(id=self.kwargs['pk']), token)
+        try:
+            cart = super().get_object()
+        except Http404:
+            set_materialized(self.kwargs['pk'], False)
+            return get_empty_cart(Cart(id=self.kwargs['pk']), token)
+        cart.token = token
+        return cart
+
+    def perform_create(self, serializer):
+        cart_store = get_cart_store()
+        if cart_store is not None:
+            serializer.instance = cart_store.create()
+        elif settings.LAZY_CARTS:
+            serializer.instance = create_lazy_cart()
+        else:
+            super().perform_create(serializer)
+
+    def perform_destroy(self, instance):
+        cart_store = get_cart_store()
+        if cart_store is not None:
+            cart_store.delete(instance.id)
+        elif not instance._state.adding:
+            super().perform_destroy(instance)
+            if self.cart_token:
+                set_materialized(instance.id, False)
+
+    @action(detail=True)
+    def summary(self, request, pk):
+        """Item count and total for checkout previews, without the items."""
+        return Response(CartSummarySerializer(self.get_object()).data)
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
     permission_classes = [AllowAny]
 
     def get_serializer_class(self):
+        if self.action == 'bulk':
+            return BulkCartItemSerializer
         if self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
             return UpdateCartItemSerializer
         return CartItemSerializer
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        try:
+            self.kwargs['cart_pk'], self.cart_token = parse_cart_id(self.kwargs['cart_pk'])
+        except ValueError:
+            raise Http404
+
     def get_serializer_context(self):
-        return {'cart_id': self.kwargs['cart_pk']}
+        return {'cart_id': self.kwargs['cart_pk'], 'cart_token': self.cart_token}
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     def get_queryset(self):
         return CartItem.objects \
             .filter(cart_id=self.kwargs['cart_pk']) \
             .select_related('product')
 
+    def list(self, request, *args, **kwargs):
+        cart_store = get_cart_store()
+        if cart_store is None:
+            if self.cart_token and is_materialized(self.kwargs['cart_pk']) is False:
+                return Response([])
+            return super().list(request, *args, **kwargs)
+        items = cart_store.get_items(self.kwargs['cart_pk'])
+        return Response(self.get_serializer(items, many=True).data)
+
+    def get_object(self):
+        cart_store = get_cart_store()
+        if cart_store is None:
+            return super().get_object()
+        item = cart_store.get_item(self.kwargs['cart_pk'], self.kwargs['pk'])
+        if item is None:
+            raise Http404
+        return item
+
+    def perform_update(self, serializer):
+        cart_store = get_cart_store()
+        if cart_store is None:
+            # Lock the cart before the line, like the add path, then let the
+            # CartItem signal refresh its totals in the same transaction.
+            with transaction.atomic():
+                Cart.objects.select_for_update().filter(pk=serializer.instance.cart_id).exists()
+                super().perform_update(serializer)
+            return
+        item = cart_store.set_quantity(
+            self.kwargs['cart_pk'], serializer.instance.id,
+            serializer.validated_data['quantity'])
+        if item is None:
+            raise Http404
+        serializer.instance = item
+
+    def perform_destroy(self, instance):
+        cart_store = get_cart_store()
+        if cart_store is None:
+            with transaction.atomic():
+                carts = Cart.objects.filter(pk=instance.cart_id)
+                carts.select_for_update().exists()
+                super().perform_destroy(instance)
+                carts.refresh_totals()
+            return
+        cart_store.remove_item(self.kwargs['cart_pk'], instance.id)
+
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def bulk(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        # Lazy carts are addressed by their token, as CartViewSet returns them
+        cart.token = self.cart_token
+        return Response(CartSerializer(cart).data)
+
 
 class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all()
@@ -101,7 +310,11 @@ class CustomerViewSet(ModelViewSet):
 
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
-        return Response('ok')
+        history = CustomerHistory.objects.filter(pk=pk).first()
+        if history is None:
+            # No orders yet, or not backfilled
+            history = CustomerHistory(customer=get_object_or_404(Customer, pk=pk))
+        return Response(CustomerHistorySerializer(history).data)
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
@@ -120,12 +333,49 @@ class CustomerViewSet(ModelViewSet):
 class OrderViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
     permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    pagination_class = OrderPagination
 
     def get_permissions(self):
-        if self.request.method in ['PATCH', 'DELETE']:
+        if self.request.method in ['PATCH', 'DELETE'] or self.action in ['bulk_update', 'export']:
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    @action(detail=False, methods=['POST'])
+    def bulk_update(self, request):
+        """
+        {"orders": [{"id": 1, "payment_status": "C"}, ...]} ->
+        {"updated": {"C": [1, ...]}, "skipped": [...]}
+        """
+        serializer = BulkUpdateOrderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changes = serializer.save()
+        moved = {order_id for order_ids in changes.values() for order_id in order_ids}
+        skipped = [order['id'] for order in serializer.validated_data['orders']
+                   if order['id'] not in moved]
+        return Response({'updated': changes, 'skipped': skipped})
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Stream the orders matching the list filters with their items, as
+        ?output=csv (the default) or ?output=ndjson.
+        """
+        output = request.query_params.get('output', 'csv')
+        if output not in exports.FORMATS:
+            return Response(
+                {'output': [f'Must be one of: {", ".join(exports.FORMATS)}.']},
+                status=status.HTTP_400_BAD_REQUEST)
+        querysets = [self.filter_queryset(Order.objects.all()),
+                     self.filter_archive(ArchivedOrder.objects.all())]
+        response = StreamingHttpResponse(
+            exports.export_orders(querysets, output),
+            content_type=exports.FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
+
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
             data=request.data,
@@ -142,15 +392,81 @@ class OrderViewSet(ModelViewSet):
             return UpdateOrderSerializer
         return OrderSerializer
 
-    def get_queryset(self):
+    def list(self, request, *args, **kwargs):
+        # Old complete orders live in the archive; one page may mix both.
+        querysets = [self.filter_queryset(self.get_queryset()),
+                     self.filter_archive(self.get_queryset(ArchivedOrder))]
+        page = self.paginator.paginate_querysets(querysets, request, self)
+        data = [ArchivedOrderSerializer(order).data if isinstance(order, ArchivedOrder)
+                else OrderSerializer(order).data
+                for order in page]
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Old complete orders live in the archive under the same id
+            order = get_object_or_404(self.get_queryset(ArchivedOrder), pk=kwargs['pk'])
+            return Response(ArchivedOrderSerializer(order).data)
+
+    def get_queryset(self, model=Order):
         user = self.request.user
+        products = Product.objects.only('id', 'title', 'unit_price')
+        queryset = model.objects.prefetch_related(
+            Prefetch('items__product', queryset=products))
 
         if user.is_staff:
-            return Order.objects.all()
+            return queryset
+        return queryset.filter(customer__user_id=user.id)
 
-        customer_id = Customer.objects.only(
-            'id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+    def filter_archive(self, queryset):
+        # DjangoFilterBackend only takes Order querysets; the fields match.
+        return self.filterset_class(
+            self.request.query_params, queryset=queryset, request=self.request).qs
+
+
+class SalesReportViewSet(GenericViewSet):
+    """
+    Sales of complete orders per product or collection, read from the
+    daily rollups that store.reports keeps, never from the orders.
+    """
+    permission_classes = [IsAdminUser]
+    pagination_class = DefaultPagination
+
+    @action(detail=False)
+    def products(self, request):
+        return self.get_report(ProductSales, 'product_id', ProductSalesSerializer)
+
+    @action(detail=False)
+    def collections(self, request):
+        return self.get_report(CollectionSales, 'collection_id', CollectionSalesSerializer)
+
+    def get_report(self, model, key, serializer_class):
+        query = SalesReportQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        query = query.validated_data
+
+        queryset = model.objects.filter(date__range=(query['start'], query['end']))
+        if query.get('id'):
+            queryset = queryset.filter(**{f'{key}__in': query['id']})
+        if query['group_by'] == 'day':
+            queryset = queryset \
+                .order_by('date', key) \
+                .values('date', key, 'units', 'revenue', 'orders')
+        else:
+            queryset = queryset \
+                .values(key) \
+                .annotate(total_units=Sum('units'), total_revenue=Sum('revenue'),
+                          total_orders=Sum('orders')) \
+                .order_by('-total_revenue', key)
+
+        rows = self.paginate_queryset(queryset)
+        if query['group_by'] == 'range':
+            rows = [{key: row[key], 'units': row['total_units'],
+                     'revenue': row['total_revenue'], 'orders': row['total_orders']}
+                    for row in rows]
+        return self.get_paginated_response(serializer_class(rows, many=True).data)
 
 
 class ProductImageViewSet(ModelViewSet):
@@ -182,12 +498,14 @@ class ProductListView(ListView):
         # Apply search
         search = self.request.GET.get('search')
         if search:
-            queryset = queryset.filter(title__icontains=search)
+            queryset = search_products(queryset, search)
 
         # Apply ordering
-        ordering = self.request.GET.get('ordering', 'title')
+        ordering = self.request.GET.get('ordering')
         if ordering:  # Only apply ordering if it's not empty
             queryset = queryset.order_by(ordering)
+        elif search:
+            queryset = queryset.order_by('-search_rank', 'id')  # Most relevant first
         else:
             queryset = queryset.order_by('title')  # Default ordering
 
@@ -220,7 +538,7 @@ class CollectionListView(ListView):
     paginate_by = 12
 
     def get_queryset(self):
-        return Collection.objects.annotate(products_count=Count('products')).all()
+        return Collection.objects.all()
 
 
 class CartView(TemplateView):
@@ -240,7 +558,14 @@ class OrderDetailView(DetailView):
     template_name = 'store/order_detail.html'
     context_object_name = 'order'
 
-    def get_queryset(self):
-        return Order.objects.prefetch_related('items__product__images').filter(
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # Old complete orders live in the archive under the same id
+            return super().get_object(self.get_queryset(ArchivedOrder))
+
+    def get_queryset(self, model=Order):
+        return model.objects.prefetch_related('items__product__images').filter(
             customer__user=self.request.user
         )
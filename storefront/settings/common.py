@@ -151,6 +151,24 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = 'core.User'
 
+# Rates are managed as store.TaxRate rows; these apply when none match.
+DEFAULT_TAX_RATE = '0.10'
+TAX_REGION = ''
+
+# 'db' keeps carts in Cart/CartItem rows; 'redis' keeps them in the
+# CART_CACHE Redis (django_redis) and writes them to the tables at checkout.
+CART_ENGINE = 'db'
+CART_CACHE = 'default'
+# With the 'db' engine, POST /carts/ hands out a signed token and the Cart
+# row is only created when the first item is added.
+LAZY_CARTS = False
+# Idle carts expire after a week: Redis carts by TTL, database carts
+# through the store.tasks.purge_abandoned_carts beat task.
+CART_TIMEOUT = 7 * 24 * 60 * 60
+# Complete orders older than this are moved to the archive tables by the
+# store.tasks.archive_orders beat task.
+ORDER_ARCHIVE_AGE = 365 * 24 * 60 * 60
+
 DJOSER = {
     'SERIALIZERS': {
         'user_create': 'core.serializers.UserCreateSerializer',
@@ -182,6 +200,24 @@ ADMINS = [
 #         'args': ['Hello from Celery!'],
 #     },
 # }
+CELERY_BEAT_SCHEDULE = {
+    'purge_abandoned_carts': {
+        'task': 'store.tasks.purge_abandoned_carts',
+        'schedule': 60 * 60,  # hourly
+    },
+    'dispatch_outbox': {
+        'task': 'store.tasks.dispatch_outbox',
+        'schedule': 5,
+    },
+    'refresh_sales_rollups': {
+        'task': 'store.tasks.refresh_sales_rollups',
+        'schedule': 15 * 60,
+    },
+    'archive_orders': {
+        'task': 'store.tasks.archive_orders',
+        'schedule': 24 * 60 * 60,  # daily
+    },
+}
 
 CACHES = {
     "default": {